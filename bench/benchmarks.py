@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime
+
+import numpy as np
+
+from helpers.numpy_extensions import averages_3d, repeat_3d, zoom_3d
+from helpers.paths import BENCH_DIR, BENCH_BASELINE_PATH, experiment_dir_path, code_path, decoded_sequence_path
+from codec.models import Config, EncodingType, DecodingType, Shape3D
+from codec.rd import convex_hull, convex_hulls, bisection
+from bench.synthetic import create_synthetic_sequence
+from runner import create_encoder, create_decoder
+from stats.metrics import calculate_sequence_metrics
+
+# runs slower than baseline by more than this fraction are reported as regressions
+REGRESSION_THRESHOLD = 0.1
+
+FULL_SEQUENCE = (288, 352, 16)
+QUICK_SEQUENCE = (144, 176, 8)
+
+
+def measure(function, repeats):
+    # the best time is the least disturbed by other processes, the mean shows how noisy the runs were
+    times = []
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+
+    return min(times), sum(times) / len(times)
+
+
+def throughput(seconds, mean_seconds, data_bytes):
+    return {'seconds': seconds, 'mean_seconds': mean_seconds, 'mb_per_s': data_bytes / seconds / 1e6}
+
+
+def micro_benchmarks(repeats):
+    # inputs shaped like the ones codecs work on - blocks of a CIF part stacked together
+    rng = np.random.default_rng(0)
+    config = Config(8, 8, 4, 1.0, EncodingType.AVERAGE_INTERPOLATE, DecodingType.INTERPOLATE, '')
+
+    blocks = rng.integers(0, 256, (1584, 8, 8, 4), dtype=np.uint8)
+    samples = rng.integers(0, 256, (1584, 3, 3, 3), dtype=np.uint8)
+
+    # RD points of every mode of every block with distortion falling as rate grows
+    rates = np.array([mode.rate for mode in config.modes])
+    rds = np.empty((1584, len(rates), 3))
+    rds[:, :, 0] = np.arange(len(rates))
+    rds[:, :, 1] = rates
+    rds[:, :, 2] = 2000 / (rates + 1) * rng.uniform(0.5, 1.5, (1584, len(rates)))
+
+    hulls = convex_hulls(rds)
+
+    benchmarks = {
+        'averages_3d': (lambda: averages_3d(blocks, Shape3D(2, 2, 2), Shape3D(4, 4, 2)), blocks.nbytes),
+        'repeat_3d': (lambda: repeat_3d(samples, Shape3D(4, 4, 2)), samples.nbytes * 32),
+        'zoom_3d': (lambda: zoom_3d(samples, Shape3D(9, 9, 5)), samples.nbytes),
+        'convex_hull': (lambda: [convex_hull(rd) for rd in rds[:100]], rds[:100].nbytes),
+        'convex_hulls': (lambda: convex_hulls(rds), rds.nbytes),
+        'bisection': (lambda: bisection(hulls, 1.0), rds.nbytes)
+    }
+
+    report = {}
+
+    for name, (function, data_bytes) in benchmarks.items():
+        report[name] = throughput(*measure(function, repeats), data_bytes)
+
+        print(f'{name:<16}{report[name]["seconds"] * 1000:10.2f} ms')
+
+    return report
+
+
+def end_to_end_benchmarks(sequence_path, frames, repeats, workers):
+    # every stage runs on its own, so its time does not include the others, like in run_codec
+    sequence_bytes = os.path.getsize(sequence_path)
+    report = {}
+
+    for encoding in EncodingType:
+        for decoding in DecodingType:
+            config = Config(8, 8, 4, 1.0, encoding, decoding, 'bench', workers=workers)
+            os.makedirs(experiment_dir_path(sequence_path, config.name), exist_ok=True)
+
+            decoded_path = decoded_sequence_path(sequence_path, config.name)
+
+            stages = {
+                'encode': lambda: create_encoder(sequence_path, config).encode(),
+                'decode': lambda: create_decoder(sequence_path, config).decode(),
+                'metrics': lambda: calculate_sequence_metrics(sequence_path, decoded_path, workers)
+            }
+
+            result = {}
+
+            for stage, function in stages.items():
+                seconds, mean_seconds = measure(function, repeats)
+
+                result[stage] = throughput(seconds, mean_seconds, sequence_bytes)
+                result[stage]['frames_per_s'] = frames / seconds
+
+            # output of the codec is recorded as well, so a faster run which changes it is not taken for an improvement
+            result['code_size'] = os.path.getsize(code_path(sequence_path, config.name))
+            result['psnr'] = calculate_sequence_metrics(sequence_path, decoded_path, workers).psnr()
+
+            report[config.name] = result
+
+            print(f'{config.name:<52}' + ''.join(f'{stage} {result[stage]["frames_per_s"]:8.2f} fps   ' for stage in stages))
+
+    return report
+
+
+def run_benchmarks(quick=False, repeats=3, workers=1):
+    rows, cols, frames = QUICK_SEQUENCE if quick else FULL_SEQUENCE
+    sequence_path = create_synthetic_sequence(rows, cols, frames)
+
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count()},
+        'sequence': {'resolution': f'{rows}x{cols}', 'frames': frames},
+        'repeats': repeats,
+        'workers': workers,
+        'micro': micro_benchmarks(repeats),
+        'end_to_end': end_to_end_benchmarks(sequence_path, frames, repeats, workers)
+    }
+
+
+def compare_reports(report, baseline, threshold=REGRESSION_THRESHOLD):
+    # ratio of best times of every benchmark present in both reports, above 1 means slower than baseline
+    rows = []
+
+    for name, result in report['micro'].items():
+        if name in baseline['micro']:
+            rows.append((name, baseline['micro'][name]['seconds'], result['seconds'], ''))
+
+    for name, result in report['end_to_end'].items():
+        if name not in baseline['end_to_end']:
+            continue
+
+        base_result = baseline['end_to_end'][name]
+        output_changed = result['code_size'] != base_result['code_size'] or not np.isclose(result['psnr'], base_result['psnr'])
+
+        for stage in ['encode', 'decode', 'metrics']:
+            rows.append((f'{name} {stage}', base_result[stage]['seconds'], result[stage]['seconds'], 'output changed' if output_changed else ''))
+
+    comparison = []
+
+    for name, base_seconds, seconds, note in rows:
+        ratio = seconds / base_seconds
+        regression = ratio > 1 + threshold
+
+        comparison.append({'name': name, 'baseline_seconds': base_seconds, 'seconds': seconds, 'ratio': ratio, 'regression': regression, 'note': note})
+
+        print(f'{name:<56}{base_seconds:10.4f} s{seconds:10.4f} s{ratio:8.2f}x  {"REGRESSION" if regression else ""} {note}')
+
+    return comparison
+
+
+def save_report(report, report_path):
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    json.dump(report, open(report_path, 'w'), indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of codec stages on a synthetic sequence')
+    parser.add_argument('--quick', action='store_true', help='smaller sequence, for a fast check')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--baseline', default=BENCH_BASELINE_PATH, help='report to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save the report as a new baseline')
+    args = parser.parse_args()
+
+    bench_report = run_benchmarks(args.quick, args.repeats, args.workers)
+
+    if args.save_baseline:
+        save_report(bench_report, args.baseline)
+    elif os.path.exists(args.baseline):
+        baseline_report = json.load(open(args.baseline))
+
+        # times of different sequences are not comparable
+        if baseline_report['sequence'] == bench_report['sequence']:
+            bench_report['comparison'] = compare_reports(bench_report, baseline_report)
+        else:
+            print(f'Baseline was measured on a different sequence: {baseline_report["sequence"]}')
+
+    save_report(bench_report, os.path.join(BENCH_DIR, f'bench_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'))
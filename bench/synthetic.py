@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+from helpers.paths import synthetic_sequence_path
+from yuv_io.yuv_writer import YuvWriter
+
+
+def create_synthetic_sequence(rows, cols, frames, seed=0):
+    # the same arguments always give the same file, which is written only when it does not exist yet
+    sequence_path = synthetic_sequence_path(rows, cols, seed)
+
+    if os.path.exists(sequence_path) and os.path.getsize(sequence_path) == rows * cols * frames * 3 // 2:
+        return sequence_path
+
+    os.makedirs(os.path.dirname(sequence_path), exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    writer = YuvWriter(sequence_path)
+
+    # texture moving with the camera gives blocks both detail and temporal correlation
+    texture = rng.normal(0, 12, (rows, cols))
+    r, c = np.mgrid[0:rows, 0:cols]
+
+    square_size = max(rows, cols) // 6
+    uv_r, uv_c = 2 * np.mgrid[0:rows//2, 0:cols//2]
+
+    for i in range(frames):
+        y = 110 + 40 * np.sin((c + 2 * i) / 11) * np.cos((r - i) / 17) + np.roll(texture, (i, 2 * i), axis=(0, 1))
+
+        # bright square crossing the frame diagonally
+        square_r = (3 * i) % rows
+        square_c = (5 * i) % cols
+        y[square_r:square_r+square_size, square_c:square_c+square_size] += 80
+
+        y += rng.normal(0, 2, (rows, cols))
+
+        u = 128 + 30 * np.sin((uv_r + uv_c + i) / 23)
+        v = 128 + 30 * np.cos((uv_r - uv_c - i) / 29)
+
+        writer.write_next_planes(*[np.clip(np.rint(plane), 0, 255).astype(np.uint8) for plane in [y, u, v]])
+
+    writer.close()
+
+    return sequence_path
@@ -0,0 +1,63 @@
+import json
+import os
+from enum import Enum
+
+from helpers.hashing import cached_file_hash, text_hash
+from helpers.paths import FILE_HASHES_PATH, atomic_write, artifacts_path, code_path, metadata_path, decoded_sequence_path, \
+    intensity_map_path, error_map_path, stats_path
+from helpers.resources import ResourceUsage
+from codec.models import Config
+
+# bump when output of a stage for the same source and config changes, later stages are invalidated along
+ENCODER_VERSION = 1
+DECODER_VERSION = 1
+ANALYSIS_VERSION = 1
+
+
+class Stage(Enum):
+    ENCODE = 1
+    DECODE = 2
+    ANALYSE = 3
+
+
+# Outputs of every stage of an experiment are valid as long as the key they were made with does not change. Key of
+# encoding depends on content of the source, config and encoder version, key of every next stage on the key of the
+# previous one and its own version, so a changed source or codec invalidates only the stages which depend on it.
+class ArtifactsCache:
+    def __init__(self, sequence_path, config: Config):
+        self.sequence_path = sequence_path
+        self.config = config
+        self.path = artifacts_path(sequence_path, config.name)
+
+        encode_key = text_hash(f'{cached_file_hash(sequence_path, FILE_HASHES_PATH)}__{config.name}__{ENCODER_VERSION}')
+        decode_key = text_hash(f'{encode_key}__{DECODER_VERSION}')
+        analyse_key = text_hash(f'{decode_key}__{ANALYSIS_VERSION}')
+
+        self.keys = {Stage.ENCODE: encode_key, Stage.DECODE: decode_key, Stage.ANALYSE: analyse_key}
+
+        self.stages = json.load(open(self.path)) if os.path.exists(self.path) else {}
+
+    def outputs(self, stage: Stage):
+        if stage == Stage.ENCODE:
+            paths = [code_path, metadata_path]
+        elif stage == Stage.DECODE:
+            paths = [decoded_sequence_path]
+        else:
+            paths = [intensity_map_path, error_map_path, stats_path]
+
+        return [path_function(self.sequence_path, self.config.name) for path_function in paths]
+
+    def is_valid(self, stage: Stage):
+        saved = self.stages.get(stage.name)
+
+        return saved is not None and saved['key'] == self.keys[stage] and all(os.path.exists(path) for path in self.outputs(stage))
+
+    def usage(self, stage: Stage):
+        return ResourceUsage(**self.stages[stage.name]['usage'])
+
+    def save(self, stage: Stage, usage: ResourceUsage):
+        # called once all outputs of the stage are written
+        self.stages[stage.name] = {'key': self.keys[stage], 'usage': usage.as_dict()}
+
+        with atomic_write(self.path) as file:
+            json.dump(self.stages, file, indent=4)
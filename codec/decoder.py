@@ -0,0 +1,42 @@
+import numpy as np
+
+from helpers.array_iterator import ArrayIterator
+from helpers.paths import metadata_path, decoded_sequence_path
+from codec.models import Config
+from yuv_io.yuv_writer import YuvWriter
+
+
+# Part by part decoding shared by decoders - every part is decoded and written by decode_part, which is given parts
+# read from code and metadata files by decode, or parts straight from the encoder in the closed loop.
+class Decoder:
+    def __init__(self, code_path, config: Config, source_shape=None):
+        self.config = config
+        self.code_path = code_path
+
+        # shape of frames is stored at the beginning of metadata, parts decoded straight from the encoder come
+        # before it is written, so they are given the shape the encoder reads
+        self.source_rows, self.source_cols = source_shape if source_shape is not None else (None, None)
+
+        self.writer = YuvWriter(decoded_sequence_path(code_path))
+
+    def decode(self):
+        with open(self.code_path, 'rb') as file:
+            code_stream = ArrayIterator(np.fromfile(file, dtype=np.uint8))
+
+        with open(metadata_path(self.code_path), 'rb') as file:
+            self.source_rows = int(np.fromfile(file, dtype=np.uint16, count=1)[0])
+            self.source_cols = int(np.fromfile(file, dtype=np.uint16, count=1)[0])
+            metadata = ArrayIterator(np.fromfile(file, dtype=np.uint8))
+
+        try:
+            while code_stream.has_next():
+                self.decode_part(code_stream, metadata)
+        finally:
+            self.close()
+
+    def decode_part(self, code_stream: ArrayIterator, metadata: ArrayIterator):
+        # decodes and writes the next part, returns its planes as they are written
+        raise NotImplementedError
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,98 @@
+from itertools import repeat
+
+import numpy as np
+
+from helpers.parallel import ordered_map
+from helpers.paths import code_path, metadata_path, video_shape
+from helpers.tracing import traced
+from codec.rd_cache import RdHullsCache
+from codec.rd import bisection, greedy_slope
+from codec.models import Config, AllocationType
+from yuv_io.yuv_reader import YuvReader
+
+
+# Part by part encoding shared by encoders - parts come from read_parts, blocks of each part are cut into groups of
+# the same shape by split_part_into_groups, which get_rd_hulls_for_blocks and get_codes_for_blocks work on.
+class Encoder:
+    def __init__(self, sequence_path, config: Config):
+        allocation_functions = {
+            AllocationType.BISECTION: bisection,
+            AllocationType.GREEDY_SLOPE: greedy_slope
+        }
+
+        self.allocation_function = allocation_functions[config.allocation_type]
+        self.config = config
+
+        self.sequence_path = sequence_path
+        self.source_rows, self.source_cols = video_shape(sequence_path)
+
+    def encode(self):
+        for _ in self.encode_parts():
+            pass
+
+    def encode_parts(self):
+        # code and metadata of every part are yielded once they are written, so the part can be decoded right away
+        # RD hulls do not depend on target BPP, so they can be reused by runs which differ only in it
+        rd_cache = RdHullsCache(self.sequence_path, self.config) if self.config.rd_cache else None
+        cached_hulls = rd_cache.load() if rd_cache is not None else None
+
+        # hulls are sent back from workers and kept only when they are going to be saved
+        keep_hulls = rd_cache is not None and cached_hulls is None
+
+        parts = self.read_parts(YuvReader(self.sequence_path))
+        parts_hulls = cached_hulls if cached_hulls is not None else repeat(None)
+        computed_hulls = []
+
+        with open(code_path(self.sequence_path, self.config.name), 'wb') as code_writer, \
+                open(metadata_path(self.sequence_path, self.config.name), 'wb') as metadata_writer:
+            metadata_writer.write(self.source_rows.to_bytes(2, 'little'))
+            metadata_writer.write(self.source_cols.to_bytes(2, 'little'))
+
+            # parts are independent, so they can be encoded in separate processes and written back in order
+            for code, metadata, hulls in ordered_map(self.encode_part, zip(parts, parts_hulls, repeat(keep_hulls)), self.config.workers):
+                code_writer.write(code)
+                metadata_writer.write(metadata)
+
+                if keep_hulls:
+                    computed_hulls.append(hulls)
+
+                yield code, metadata
+
+        if keep_hulls:
+            rd_cache.save(computed_hulls)
+
+    def read_parts(self, source_reader: YuvReader):
+        raise NotImplementedError
+
+    @traced('encode part')
+    def encode_part(self, part_with_hulls):
+        part, hulls, keep_hulls = part_with_hulls
+        groups = self.split_part_into_groups(*part)
+
+        # prepare RD hulls (unless they come from cache) and find best modes
+        if hulls is None:
+            hulls = [None] * sum(len(indices) for indices, _ in groups)
+
+            for indices, data in groups:
+                for idx, hull in zip(indices, self.get_rd_hulls_for_blocks(data)):
+                    hulls[idx] = hull
+
+        mode_ids = self.allocation_function(hulls, self.config.target_bpp)
+
+        # encode part with best modes
+        codes = [None] * len(hulls)
+
+        for indices, data in groups:
+            for idx, code in zip(indices, self.get_codes_for_blocks(data, [mode_ids[i] for i in indices])):
+                codes[idx] = code
+
+        return np.hstack(codes), bytes(mode_ids), hulls if keep_hulls else None
+
+    def split_part_into_groups(self, y_part, u_part, v_part):
+        raise NotImplementedError
+
+    def get_rd_hulls_for_blocks(self, data):
+        raise NotImplementedError
+
+    def get_codes_for_blocks(self, data, mode_ids):
+        raise NotImplementedError
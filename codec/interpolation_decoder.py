@@ -1,95 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 from helpers.array_iterator import ArrayIterator
-from helpers.numpy_extensions import zoom_3d, pick_first_samples
-from helpers.paths import metadata_path, decoded_sequence_path
+from helpers.numpy_extensions import zoom_3d, pick_first_samples, pick_last_samples
+from helpers.tracing import traced
+from codec.decoder import Decoder
 from codec.models import Config, Shape3D, SamplingMode
-from yuv_io.yuv_writer import YuvWriter
-
-
-class InterpolationDecoder:
-    def __init__(self, code_path, config: Config):
-        self.config = config
-
-        with open(code_path, 'rb') as file:
-            self.code = ArrayIterator(np.fromfile(file, dtype=np.uint8))
-
-        with open(metadata_path(code_path), 'rb') as file:
-            self.source_rows = np.fromfile(file, dtype=np.uint16, count=1)[0]
-            self.source_cols = np.fromfile(file, dtype=np.uint16, count=1)[0]
-            self.metadata = ArrayIterator(np.fromfile(file, dtype=np.uint8))
-
-        self.writer = YuvWriter(decoded_sequence_path(code_path))
-
-    def decode(self):
-        y_part = np.empty((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
-        u_part = np.empty((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
-        v_part = np.empty((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
-
-        is_first_part = True
-        while self.code.has_next():
-            for r in range(0, self.source_rows, self.config.block.rows):
-                for c in range(0, self.source_cols, self.config.block.cols):
-                    block = Shape3D(
-                        min(self.config.block.rows, self.source_rows - r),
-                        min(self.config.block.cols, self.source_cols - c),
-                        self.config.block.frames)
-
-                    mode_id = self.metadata.get()
-                    mode = self.config.get_mode(mode_id, block)
-
-                    # get extended input
-                    y_input = pick_first_samples(y_part[r:r+block.rows+1, c:c+block.cols+1, :], mode.y_chunk)
-                    u_input = pick_first_samples(u_part[r:r+block.rows+1, c:c+block.cols+1, :], mode.uv_chunk)
-                    v_input = pick_first_samples(v_part[r:r+block.rows+1, c:c+block.cols+1, :], mode.uv_chunk)
-
-                    # fit code into extended input
-                    y_input[1:, 1:, 1:] = self.code.get_many(mode.y_points.as_tuple())
-                    u_input[1:, 1:, 1:] = self.code.get_many(mode.uv_points.as_tuple())
-                    v_input[1:, 1:, 1:] = self.code.get_many(mode.uv_points.as_tuple())
-
-                    # duplicate code values in edge cases
-                    if is_first_part:
-                        y_input[:, :, 0] = y_input[:, :, 1]
-                        u_input[:, :, 0] = u_input[:, :, 1]
-                        v_input[:, :, 0] = v_input[:, :, 1]
-
-                    if r == 0:
-                        y_input[0, :, :] = y_input[1, :, :]
-                        u_input[0, :, :] = u_input[1, :, :]
-                        v_input[0, :, :] = v_input[1, :, :]
-
-                    if c == 0:
-                        y_input[:, 0, :] = y_input[:, 1, :]
-                        u_input[:, 0, :] = u_input[:, 1, :]
-                        v_input[:, 0, :] = v_input[:, 1, :]
-
-                    # decode and fill part with proper data
-                    y_block, u_block, v_block = self.interpolate_samples(y_input, u_input, v_input, mode)
-
-                    y_part[r+1:r+block.rows+1, c+1:c+block.cols+1, 1:] = y_block[1:, 1:, 1:]
-                    u_part[r+1:r+block.rows+1, c+1:c+block.cols+1, 1:] = u_block[1:, 1:, 1:]
-                    v_part[r+1:r+block.rows+1, c+1:c+block.cols+1, 1:] = v_block[1:, 1:, 1:]
-
-            # save ready part
-            for i in range(self.config.block.frames):
-                frame = np.dstack((y_part[1:, 1:, i+1], u_part[1:, 1:, i+1], v_part[1:, 1:, i+1]))
-                self.writer.write_next(frame)
-
-            # copy last frame from part into first frame in next part
-            y_part[:, :, 0] = y_part[:, :, -1]
-            u_part[:, :, 0] = u_part[:, :, -1]
-            v_part[:, :, 0] = v_part[:, :, -1]
-
-            is_first_part = False
 
-        self.writer.close()
+# blocks with at least this many luma samples are decoded in a wavefront on config.workers threads, on 1080p
+# interpolation of 64x64x4 and larger blocks is mostly in array operations which release the GIL, smaller
+# blocks spend most of their time in Python overhead of these operations and gain nothing from threads
+WAVEFRONT_MIN_BLOCK_SIZE = 64 * 64 * 4
+
+
+class InterpolationDecoder(Decoder):
+    def __init__(self, code_path, config: Config, source_shape=None):
+        super().__init__(code_path, config, source_shape)
+
+        # parts with decoded row, column and frame preceding them, the last frame of a part precedes the next one
+        self.parts = None
+        self.is_first_part = True
+
+    @traced('decode part')
+    def decode_part(self, code_stream: ArrayIterator, metadata: ArrayIterator):
+        uv_subsampling = self.config.uv_subsampling
+        uv_rows, uv_cols = self.source_rows // uv_subsampling.rows, self.source_cols // uv_subsampling.cols
+
+        if self.parts is None:
+            self.parts = (
+                np.empty((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8),
+                np.empty((uv_rows+1, uv_cols+1, self.config.block.frames+1), dtype=np.uint8),
+                np.empty((uv_rows+1, uv_cols+1, self.config.block.frames+1), dtype=np.uint8))
+
+        y_part, u_part, v_part = self.parts
+
+        # blocks in row-major order, the same as code and metadata are written
+        blocks = [
+            (r, c, Shape3D(min(self.config.block.rows, self.source_rows - r), min(self.config.block.cols, self.source_cols - c), self.config.block.frames))
+            for r in range(0, self.source_rows, self.config.block.rows)
+            for c in range(0, self.source_cols, self.config.block.cols)]
+
+        # code of every block starts where code of previous one ends
+        modes = [self.config.get_mode(mode_id, block) for mode_id, (_, _, block) in zip(metadata.get_many((len(blocks),)), blocks)]
+        code_lengths = np.array([mode.y_points.count + 2 * mode.uv_points.count for mode in modes])
+        code_starts = np.cumsum(code_lengths) - code_lengths
+        code = code_stream.get_many((code_lengths.sum(),))
+
+        def decode_block(idx):
+            r, c, _ = blocks[idx]
+            block_code = code[code_starts[idx]:code_starts[idx]+code_lengths[idx]]
+
+            self.decode_block(y_part, u_part, v_part, r, c, modes[idx], block_code, self.is_first_part)
+
+        # every block depends only on the row, column and frame decoded by its top, left and top-left neighbours,
+        # so blocks of the same anti-diagonal are independent, they are decoded concurrently when they are large
+        # enough for interpolation to run mostly outside of the GIL, anti-diagonals one after another
+        if self.config.workers > 1 and self.config.block.count >= WAVEFRONT_MIN_BLOCK_SIZE:
+            diagonals = {}
+
+            for idx, (r, c, _) in enumerate(blocks):
+                diagonals.setdefault(r // self.config.block.rows + c // self.config.block.cols, []).append(idx)
+
+            with ThreadPoolExecutor(self.config.workers) as executor:
+                for d in sorted(diagonals):
+                    list(executor.map(decode_block, diagonals[d]))
+        else:
+            for idx in range(len(blocks)):
+                decode_block(idx)
+
+        # save ready part, full size chroma is brought back to 4:2:0 the same way as in YuvWriter
+        y_frames = y_part[1:, 1:, 1:].copy()
+        u_frames = pick_last_samples(u_part[1:, 1:, 1:], Shape3D(2, 2, 1) // uv_subsampling).copy()
+        v_frames = pick_last_samples(v_part[1:, 1:, 1:], Shape3D(2, 2, 1) // uv_subsampling).copy()
+
+        for i in range(self.config.block.frames):
+            self.writer.write_next_planes(y_frames[:, :, i], u_frames[:, :, i], v_frames[:, :, i])
+
+        # copy last frame from part into first frame in next part
+        y_part[:, :, 0] = y_part[:, :, -1]
+        u_part[:, :, 0] = u_part[:, :, -1]
+        v_part[:, :, 0] = v_part[:, :, -1]
+
+        self.is_first_part = False
+
+        return y_frames, u_frames, v_frames
+
+    @traced('decode block')
+    def decode_block(self, y_part, u_part, v_part, r, c, mode: SamplingMode, code, is_first_part):
+        uv_subsampling = self.config.uv_subsampling
+        uv_r, uv_c = r // uv_subsampling.rows, c // uv_subsampling.cols
+        block, uv_block = mode.block, mode.uv_block
+        y_size, uv_size = mode.y_points.count, mode.uv_points.count
+
+        # get extended input, copied so duplicated edges do not leak into samples shared with blocks decoded concurrently
+        y_input = pick_first_samples(y_part[r:r+block.rows+1, c:c+block.cols+1, :], mode.y_chunk).copy()
+        u_input = pick_first_samples(u_part[uv_r:uv_r+uv_block.rows+1, uv_c:uv_c+uv_block.cols+1, :], mode.uv_chunk).copy()
+        v_input = pick_first_samples(v_part[uv_r:uv_r+uv_block.rows+1, uv_c:uv_c+uv_block.cols+1, :], mode.uv_chunk).copy()
+
+        # fit code into extended input
+        y_input[1:, 1:, 1:] = code[:y_size].reshape(mode.y_points.as_tuple())
+        u_input[1:, 1:, 1:] = code[y_size:y_size+uv_size].reshape(mode.uv_points.as_tuple())
+        v_input[1:, 1:, 1:] = code[y_size+uv_size:].reshape(mode.uv_points.as_tuple())
+
+        # duplicate code values in edge cases
+        if is_first_part:
+            y_input[:, :, 0] = y_input[:, :, 1]
+            u_input[:, :, 0] = u_input[:, :, 1]
+            v_input[:, :, 0] = v_input[:, :, 1]
+
+        if r == 0:
+            y_input[0, :, :] = y_input[1, :, :]
+            u_input[0, :, :] = u_input[1, :, :]
+            v_input[0, :, :] = v_input[1, :, :]
+
+        if c == 0:
+            y_input[:, 0, :] = y_input[:, 1, :]
+            u_input[:, 0, :] = u_input[:, 1, :]
+            v_input[:, 0, :] = v_input[:, 1, :]
+
+        # decode and fill part with proper data
+        y_block, u_block, v_block = self.interpolate_samples(y_input, u_input, v_input, mode)
+
+        y_part[r+1:r+block.rows+1, c+1:c+block.cols+1, 1:] = y_block[1:, 1:, 1:]
+        u_part[uv_r+1:uv_r+uv_block.rows+1, uv_c+1:uv_c+uv_block.cols+1, 1:] = u_block[1:, 1:, 1:]
+        v_part[uv_r+1:uv_r+uv_block.rows+1, uv_c+1:uv_c+uv_block.cols+1, 1:] = v_block[1:, 1:, 1:]
 
     @staticmethod
+    @traced('interpolate samples')
     def interpolate_samples(y_input, u_input, v_input, mode: SamplingMode):
         y_block = zoom_3d(y_input, mode.block + 1)
-        u_block = zoom_3d(u_input, mode.block + 1)
-        v_block = zoom_3d(v_input, mode.block + 1)
+        u_block = zoom_3d(u_input, mode.uv_block + 1)
+        v_block = zoom_3d(v_input, mode.uv_block + 1)
 
         return y_block, u_block, v_block
 
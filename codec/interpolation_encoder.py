@@ -1,47 +1,35 @@
 import numpy as np
-from skimage.metrics import mean_squared_error
 
-from helpers.numpy_extensions import pick_first_samples
-from helpers.paths import code_path, metadata_path
+from helpers.numpy_extensions import pick_first_samples, split_into_extended_blocks, squared_errors_sum
+from helpers.tracing import traced
 from codec.interpolation_decoder import InterpolationDecoder
-from codec.rd import bisection, convex_hull
-from codec.models import Config, Shape3D, SamplingMode, BlockEncodingData
+from codec.encoder import Encoder
+from codec.rd import convex_hulls
+from codec.models import SamplingMode, BlockEncodingData, ChromaType
 from yuv_io.yuv_reader import YuvReader
 
 
-class InterpolationEncoder:
-    def __init__(self, sequence_path, config: Config):
-        self.config = config
+class InterpolationEncoder(Encoder):
+    def read_parts(self, source_reader: YuvReader):
+        uv_subsampling = self.config.uv_subsampling
+        uv_rows, uv_cols = self.source_rows // uv_subsampling.rows, self.source_cols // uv_subsampling.cols
 
-        self.source_reader = YuvReader(sequence_path)
-        self.source_rows, self.source_cols = self.source_reader.y_shape
+        previous_frames = None
 
-        self.code_writer = open(code_path(sequence_path, config.name), 'wb')
-        self.metadata_writer = open(metadata_path(sequence_path, config.name), 'wb')
-
-    def encode(self):
-        self.metadata_writer.write(self.source_rows.to_bytes(2, 'little'))
-        self.metadata_writer.write(self.source_cols.to_bytes(2, 'little'))
-
-        y_part = np.zeros((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
-        u_part = np.zeros((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
-        v_part = np.zeros((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
-
-        is_first_part = True
         while True:
+            y_part = np.zeros((self.source_rows+1, self.source_cols+1, self.config.block.frames+1), dtype=np.uint8)
+            u_part = np.zeros((uv_rows+1, uv_cols+1, self.config.block.frames+1), dtype=np.uint8)
+            v_part = np.zeros((uv_rows+1, uv_cols+1, self.config.block.frames+1), dtype=np.uint8)
+
             # read frames into part
             for i in range(self.config.block.frames):
-                frame = self.source_reader.read_next()
+                planes = source_reader.read_next_planes(upsample_uv=self.config.chroma_type == ChromaType.FULL_SIZE)
 
-                # if there is no more parts - save and return
-                if frame is None:
-                    self.code_writer.close()
-                    self.metadata_writer.close()
+                # if there is no more parts - return
+                if planes is None:
                     return
 
-                y_part[1:, 1:, i+1] = frame[:, :, 0]
-                u_part[1:, 1:, i+1] = frame[:, :, 1]
-                v_part[1:, 1:, i+1] = frame[:, :, 2]
+                y_part[1:, 1:, i+1], u_part[1:, 1:, i+1], v_part[1:, 1:, i+1] = planes
 
             # duplicate last row and last column on the part edge
             y_part[0, :, :] = y_part[1, :, :]
@@ -52,68 +40,76 @@ class InterpolationEncoder:
             v_part[:, 0, :] = v_part[:, 1, :]
             y_part[:, 0, :] = y_part[:, 1, :]
 
-            # duplicate first frame on the part edge (only for first part needed)
-            if is_first_part:
+            # duplicate first frame on the part edge for first part, copy last frame from previous part for others
+            if previous_frames is None:
                 y_part[:, :, 0] = y_part[:, :, 1]
                 u_part[:, :, 0] = u_part[:, :, 1]
                 v_part[:, :, 0] = v_part[:, :, 1]
+            else:
+                y_part[:, :, 0], u_part[:, :, 0], v_part[:, :, 0] = previous_frames
 
-                is_first_part = False
+            previous_frames = y_part[:, :, -1], u_part[:, :, -1], v_part[:, :, -1]
 
-            # prepare data for each block in part
-            params = []
+            yield y_part, u_part, v_part
 
-            for r in range(0, self.source_rows, self.config.block.rows):
-                for c in range(0, self.source_cols, self.config.block.cols):
-                    block = Shape3D(
-                        min(self.config.block.rows, self.source_rows - r),
-                        min(self.config.block.cols, self.source_cols - c),
-                        self.config.block.frames)
+    def split_part_into_groups(self, y_part, u_part, v_part):
+        # blocks of the same shape are stacked together with the row, column and frame preceding them
+        uv_subsampling = self.config.uv_subsampling
+        groups = []
 
-                    y_block = y_part[r:r+block.rows+1, c:c+block.cols+1, :]
-                    u_block = u_part[r:r+block.rows+1, c:c+block.cols+1, :]
-                    v_block = v_part[r:r+block.rows+1, c:c+block.cols+1, :]
+        for indices, (r0, r1, c0, c1), shape in self.config.get_blocks_groups(self.source_rows, self.source_cols):
+            uv_r0, uv_r1 = r0 // uv_subsampling.rows, r1 // uv_subsampling.rows
+            uv_c0, uv_c1 = c0 // uv_subsampling.cols, c1 // uv_subsampling.cols
 
-                    params.append(BlockEncodingData(y_block, u_block, v_block, block))
+            y_blocks = split_into_extended_blocks(y_part[r0:r1+1, c0:c1+1, :], shape)
+            u_blocks = split_into_extended_blocks(u_part[uv_r0:uv_r1+1, uv_c0:uv_c1+1, :], shape // uv_subsampling)
+            v_blocks = split_into_extended_blocks(v_part[uv_r0:uv_r1+1, uv_c0:uv_c1+1, :], shape // uv_subsampling)
 
-            # prepare RD hulls and find best modes
-            hulls = [self.get_rd_hull_for_block(args) for args in params]
-            mode_ids = bisection(hulls, self.config.target_bpp)
+            groups.append((indices, BlockEncodingData(y_blocks, u_blocks, v_blocks, shape)))
 
-            # encode part with best modes
-            for data, mode_id in zip(params, mode_ids):
-                mode = self.config.get_mode(mode_id, data.block)
+        return groups
 
-                y_encoded, u_encoded, v_encoded = self.pick_samples(data.y_block, data.u_block, data.v_block, mode)
-                code = self.get_code(y_encoded, u_encoded, v_encoded)
-
-                self.code_writer.write(code)
-                self.metadata_writer.write(mode_id.to_bytes(1, 'little'))
-
-            # copy last frame from part into first frame in next part
-            y_part[:, :, 0] = y_part[:, :, -1]
-            u_part[:, :, 0] = u_part[:, :, -1]
-            v_part[:, :, 0] = v_part[:, :, -1]
-
-    def get_rd_hull_for_block(self, data: BlockEncodingData):
+    @traced('rd hulls')
+    def get_rd_hulls_for_blocks(self, data: BlockEncodingData):
         modes = self.config.get_modes(data.block)
-        rd = np.empty((len(modes), 3))
+        rd = np.empty((len(data.y_block), len(modes), 3))
+
+        # position of a mode on the list is used as its id
+        rd[:, :, 0] = np.arange(len(modes))
+        rd[:, :, 1] = [mode.rate for mode in modes]  # R
 
         for idx, mode in enumerate(modes):
             y_encoded, u_encoded, v_encoded = self.pick_samples(data.y_block, data.u_block, data.v_block, mode)
             y_decoded, u_decoded, v_decoded = InterpolationDecoder.interpolate_samples(y_encoded, u_encoded, v_encoded, mode)
 
-            merged_source = np.hstack((data.y_block[1:, 1:, 1:], data.u_block[1:, 1:, 1:], data.v_block[1:, 1:, 1:]))
-            merged_decoded = np.hstack((y_decoded[1:, 1:, 1:], u_decoded[1:, 1:, 1:], v_decoded[1:, 1:, 1:]))
+            squared_errors = \
+                self.squared_errors(data.y_block, y_decoded) + self.config.uv_weight * (
+                    self.squared_errors(data.u_block, u_decoded) +
+                    self.squared_errors(data.v_block, v_decoded))
 
-            rd[idx, 0] = idx
-            rd[idx, 1] = mode.rate  # R
-            rd[idx, 2] = mean_squared_error(merged_source, merged_decoded)  # D
+            rd[:, idx, 2] = squared_errors / (data.block.count * 3)  # D
 
-        rd = rd[rd[:, 0] >= 0, :]
-        rd = convex_hull(rd)
+        return convex_hulls(rd)
 
-        return rd
+    @traced('codes')
+    def get_codes_for_blocks(self, data: BlockEncodingData, mode_ids):
+        codes = [None] * len(mode_ids)
+
+        for mode_id in sorted(set(mode_ids)):
+            selected = [idx for idx, block_mode_id in enumerate(mode_ids) if block_mode_id == mode_id]
+            mode = self.config.get_mode(mode_id, data.block)
+
+            y_encoded, u_encoded, v_encoded = self.pick_samples(data.y_block, data.u_block, data.v_block, mode)
+
+            for idx in selected:
+                codes[idx] = self.get_code(y_encoded[idx], u_encoded[idx], v_encoded[idx])
+
+        return codes
+
+    @staticmethod
+    def squared_errors(source, decoded):
+        # extended row, column and frame at the beginning are not a part of the block
+        return squared_errors_sum(source[:, 1:, 1:, 1:], decoded[:, 1:, 1:, 1:])
 
     @staticmethod
     def pick_samples(y_block, u_block, v_block, mode: SamplingMode):
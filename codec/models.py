@@ -14,6 +14,16 @@ class DecodingType(Enum):
     INTERPOLATE = 2
 
 
+class AllocationType(Enum):
+    BISECTION = 1
+    GREEDY_SLOPE = 2
+
+
+class ChromaType(Enum):
+    FULL_SIZE = 1
+    NATIVE_420 = 2
+
+
 class Shape3D:
     def __init__(self, rows, cols, frames):
         self.rows = int(rows)
@@ -34,6 +44,9 @@ class Shape3D:
     def __eq__(self, other):
         return self.rows == other.rows and self.cols == other.cols and self.frames == other.frames
 
+    def __hash__(self):
+        return hash(self.tuple)
+
     def __add__(self, n):
         return Shape3D(self.rows + n, self.cols + n, self.frames + n)
 
@@ -42,31 +55,49 @@ class Shape3D:
 
 
 class SamplingMode:
-    def __init__(self, idx: int, y_chunk: Shape3D, uv_chunk: Shape3D, block: Shape3D):
+    def __init__(self, idx: int, y_chunk: Shape3D, uv_chunk: Shape3D, block: Shape3D, uv_block: Shape3D = None):
+        # uv_chunk and uv_block are in resolution of chroma planes, which may be smaller than the block
+        uv_block = uv_block if uv_block is not None else block
+
         self.idx = idx
 
         self.y_chunk: Shape3D = y_chunk
         self.y_points: Shape3D = block // y_chunk
 
         self.uv_chunk: Shape3D = uv_chunk
-        self.uv_points: Shape3D = block // uv_chunk
+        self.uv_points: Shape3D = uv_block // uv_chunk
 
         self.block: Shape3D = block
+        self.uv_block: Shape3D = uv_block
 
         self.rate = (self.y_points.count + self.uv_points.count * 2) / (self.block.count * 3) * 24
 
 
 class Config:
-    def __init__(self, rows: int, cols: int, frames: int, target_bpp: float, encoding: EncodingType, decoding: DecodingType, info: str):
-        name = f'{rows}__{cols}__{frames}__{target_bpp}__{encoding.name.lower()}__{decoding.name.lower()}  {info}'.strip()
+    def __init__(self, rows: int, cols: int, frames: int, target_bpp: float, encoding: EncodingType, decoding: DecodingType, info: str,
+                 allocation: AllocationType = AllocationType.BISECTION, chroma: ChromaType = ChromaType.FULL_SIZE,
+                 workers: int = 1, rd_cache: bool = False, trace: bool = False):
+        allocation_info = f'__{allocation.name.lower()}' if allocation != AllocationType.BISECTION else ''
+        chroma_info = f'__{chroma.name.lower()}' if chroma != ChromaType.FULL_SIZE else ''
+        name = f'{rows}__{cols}__{frames}__{target_bpp}__{encoding.name.lower()}__{decoding.name.lower()}{allocation_info}{chroma_info}  {info}'.strip()
 
         self.name: str = name
         self.block: Shape3D = Shape3D(rows, cols, frames)
         self.target_bpp: float = target_bpp
         self.encoding_type: EncodingType = encoding
         self.decoding_type: DecodingType = decoding
-        self.chunks = self.generate_chunks(self.block)
-        self.modes = self.generate_modes(self.chunks, self.block)
+        self.allocation_type: AllocationType = allocation
+        self.chroma_type: ChromaType = chroma
+
+        # native chroma planes keep every 2x2 square of samples as one, each of them stands for 4 samples in distortion
+        self.uv_subsampling: Shape3D = Shape3D(2, 2, 1) if chroma == ChromaType.NATIVE_420 else Shape3D(1, 1, 1)
+        self.uv_weight: int = self.uv_subsampling.count
+
+        self.chunks = self.generate_chunks(self.block, self.uv_subsampling)
+        self.modes = self.generate_modes(self.chunks, self.block, self.uv_subsampling)
+        self.workers: int = workers
+        self.rd_cache: bool = rd_cache
+        self.trace: bool = trace
 
     def get_mode(self, idx, block: Shape3D):
         if block == self.block:
@@ -74,37 +105,64 @@ class Config:
 
         y_chunk, uv_chunk = self.chunks[idx]
 
-        return SamplingMode(idx, y_chunk, uv_chunk, block)
+        return SamplingMode(idx, y_chunk, uv_chunk, block, block // self.uv_subsampling)
 
     def get_modes(self, block: Shape3D):
         if block == self.block:
             return self.modes
 
-        return self.generate_modes(self.chunks, block)
+        return self.generate_modes(self.chunks, block, self.uv_subsampling)
+
+    def get_blocks_groups(self, source_rows, source_cols):
+        # blocks of the same shape (full-size ones, right edge, bottom edge and corner) are grouped together,
+        # each group keeps positions of its blocks in row-major order of the whole part
+        block = self.block
+        full_rows = source_rows // block.rows * block.rows
+        full_cols = source_cols // block.cols * block.cols
+        blocks_in_row = -(-source_cols // block.cols)
+
+        rows_ranges = [(r0, r1) for r0, r1 in [(0, full_rows), (full_rows, source_rows)] if r1 > r0]
+        cols_ranges = [(c0, c1) for c0, c1 in [(0, full_cols), (full_cols, source_cols)] if c1 > c0]
+
+        groups = []
+
+        for r0, r1 in rows_ranges:
+            for c0, c1 in cols_ranges:
+                shape = Shape3D(min(block.rows, r1 - r0), min(block.cols, c1 - c0), block.frames)
+
+                indices = [
+                    r // block.rows * blocks_in_row + c // block.cols
+                    for r in range(r0, r1, shape.rows)
+                    for c in range(c0, c1, shape.cols)]
+
+                groups.append((indices, (r0, r1, c0, c1), shape))
+
+        return groups
 
     @staticmethod
-    def generate_modes(chunks, block):
+    def generate_modes(chunks, block, uv_subsampling):
         modes = []
+        uv_block = block // uv_subsampling
 
         for idx, chunk in enumerate(chunks):
             y_chunk, uv_chunk = chunk
 
-            if block.is_divisible(uv_chunk):
-                modes.append(SamplingMode(idx, y_chunk, uv_chunk, block))
+            if uv_block.is_divisible(uv_chunk):
+                modes.append(SamplingMode(idx, y_chunk, uv_chunk, block, uv_block))
 
         return modes
 
     @staticmethod
-    def generate_chunks(block):
+    def generate_chunks(block, uv_subsampling):
         intensities = []
 
         for r in range(int(log2(block.rows))):
             for c in range(int(log2(block.cols))):
                 if block.frames == 1:
-                    intensities.append((Shape3D(2**r, 2**c, 1), Shape3D(2**r*2, 2**c*2, 1)))
+                    intensities.append((Shape3D(2**r, 2**c, 1), Shape3D(2**r*2, 2**c*2, 1) // uv_subsampling))
                 else:
                     for f in range(int(log2(block.frames))):
-                        intensities.append((Shape3D(2**r, 2**c, 2**f), Shape3D(2**r*2, 2**c*2, 2**f*2)))
+                        intensities.append((Shape3D(2**r, 2**c, 2**f), Shape3D(2**r*2, 2**c*2, 2**f*2) // uv_subsampling))
 
         return intensities
 
@@ -1,55 +1,147 @@
 import numpy as np
-from scipy.spatial import ConvexHull
+
+from helpers.tracing import traced
 
 r_max = 24
 d_max = 255 * 255
 
+collinearity_eps = 1e-12
+
 
 def convex_hull(rd):
-    r_min = np.min(rd[:, 1])
-    d_min = np.min(rd[:, 2])
+    return convex_hulls(rd[None])[0]
+
+
+@traced('convex hulls')
+def convex_hulls(rds):
+    # monotone chain over all blocks at once - points are walked in order of rate and each block keeps its own stack,
+    # point at (r_max, d_min) closes the chain so that only its part with decreasing distortion is left,
+    # distortion is scaled to the range of rate and almost collinear points are treated as collinear
+    order = np.lexsort((rds[:, :, 2], rds[:, :, 1]), axis=-1)
+    rds = np.take_along_axis(rds, order[:, :, None], axis=1)
+
+    bounds = np.column_stack((np.full(len(rds), -1), np.full(len(rds), r_max), rds[:, :, 2].min(axis=1)))
+    points = np.concatenate((rds, bounds[:, None, :]), axis=1)
+    points = np.stack((points[:, :, 1], points[:, :, 2] * r_max / d_max), axis=2)
+
+    stacks = np.zeros((len(rds), points.shape[1]), dtype=int)
+    sizes = np.zeros(len(rds), dtype=int)
+
+    for idx in range(points.shape[1]):
+        # from points with the same rate only the first one (with the lowest distortion) is used
+        is_first_with_rate = points[:, idx, 0] != points[:, idx-1, 0] if idx > 0 else np.ones(len(rds), dtype=bool)
+
+        # pop last points from stacks while they do not make a left turn with the new point
+        active = np.flatnonzero(is_first_with_rate & (sizes >= 2))
+
+        while active.size:
+            point = points[active, idx]
+            last = points[active, stacks[active, sizes[active]-1]]
+            before_last = points[active, stacks[active, sizes[active]-2]]
+
+            cross = \
+                (last[:, 0] - before_last[:, 0]) * (point[:, 1] - before_last[:, 1]) - \
+                (last[:, 1] - before_last[:, 1]) * (point[:, 0] - before_last[:, 0])
+            pop = cross <= collinearity_eps * np.hypot(*(point - before_last).T)
+
+            active = active[pop]
+            sizes[active] -= 1
+            active = active[sizes[active] >= 2]
+
+        stacks[is_first_with_rate, sizes[is_first_with_rate]] = idx
+        sizes[is_first_with_rate] += 1
+
+    # last point on every stack is the closing bound
+    return [rd[stack[:size-1]] for rd, stack, size in zip(rds, stacks, sizes)]
+
+
+def pad_hulls(rd_hulls):
+    # all hulls of a part in one (blocks, max points, 3) array, padding points are marked as not valid
+    lengths = np.array([len(rd_hull) for rd_hull in rd_hulls])
+    valid = np.arange(lengths.max()) < lengths[:, None]
 
-    hull_bounds = np.array([
-        [-1, r_min, d_max],
-        [-1, r_max, d_max],
-        [-1, r_max, d_min]
-    ])
-    rd = np.vstack((rd, hull_bounds))
+    points = np.zeros(valid.shape + (3,))
+    points[valid] = np.vstack(rd_hulls)
 
-    hull = ConvexHull(rd[:, 1:3])
+    return points, valid
 
-    rd = rd[hull.vertices]
-    rd = rd[rd[:, 0] >= 0]
 
-    return rd
+def choose_best_points(points, valid, lambdas):
+    # lambdas may be a scalar or an array of any shape, result has shape of lambdas followed by blocks
+    lambdas = np.asarray(lambdas)[..., None, None]
 
+    cost = points[:, :, 2] + lambdas * points[:, :, 1]  # J = D + lambda * R
+    cost = np.where(valid, cost, np.inf)
 
-def choose_best_point_in_rd_hull(rd_hull, lambda_):
-    cost = rd_hull[:, 2] + lambda_ * rd_hull[:, 1]  # J = D + lambda * R
-    pos = cost.argmin()
-    return rd_hull[pos, :]
+    return cost.argmin(axis=-1)
 
 
-def calculate_bpp(rd_hulls, lambda_):
-    chosen_points = [choose_best_point_in_rd_hull(rd_hull, lambda_) for rd_hull in rd_hulls]
-    rate = np.array(chosen_points)[:, 1].mean()
+def calculate_bpp(points, valid, lambdas):
+    chosen = choose_best_points(points, valid, lambdas)
+    rate = np.take_along_axis(points[:, :, 1], chosen[..., None], axis=-1)[..., 0].mean(axis=-1)
 
-    return chosen_points, rate
+    return chosen, rate
 
 
+@traced('bisection')
 def bisection(rd_hulls, target_bpp, lambda_a=0.01, lambda_b=1000.0, eps=0.01):
-    best_rd_points = []
+    points, valid = pad_hulls(rd_hulls)
+    lowest_rates = np.where(valid, points[:, :, 1], np.inf).argmin(axis=1)
+
+    # upper lambda is raised until it meets target BPP or every block gets its lowest rate,
+    # which is the choice left for a target below the lowest rates of all hulls
+    best_choice, bpp = calculate_bpp(points, valid, lambda_b)
+
+    while bpp > target_bpp and np.any(best_choice != lowest_rates):
+        lambda_a, lambda_b = lambda_b, 2 * lambda_b
+        best_choice, bpp = calculate_bpp(points, valid, lambda_b)
 
     while lambda_b - lambda_a > eps:
         lambda_ = (lambda_a + lambda_b) / 2
-        chosen_rd_points, bpp = calculate_bpp(rd_hulls, lambda_)
+        chosen, bpp = calculate_bpp(points, valid, lambda_)
 
         if bpp > target_bpp:
             lambda_a = lambda_
         else:
-            best_rd_points = chosen_rd_points
+            best_choice = chosen
             lambda_b = lambda_
 
-    mode_ids = [int(point[0]) for point in best_rd_points]
+    mode_ids = [int(mode_id) for mode_id in points[np.arange(len(best_choice)), best_choice, 0]]
+
+    return mode_ids
+
+
+@traced('greedy slope')
+def greedy_slope(rd_hulls, target_bpp):
+    # start every block at its lowest rate and take hull segments in order of decreasing RD slope,
+    # segments which do not fit into remaining rate block further segments of their hull
+    points, valid = pad_hulls(rd_hulls)
+
+    order = np.argsort(np.where(valid, points[:, :, 1], np.inf), axis=1, kind='stable')
+    points = np.take_along_axis(points, order[:, :, None], axis=1)
+
+    lengths = valid.sum(axis=1)
+    chosen = np.zeros(len(points), dtype=int)
+
+    hull_ids, starts = np.nonzero(np.arange(valid.shape[1]) < lengths[:, None] - 1)
+    rates = points[hull_ids, starts+1, 1] - points[hull_ids, starts, 1]
+    slopes = (points[hull_ids, starts, 2] - points[hull_ids, starts+1, 2]) / rates
+
+    budget = target_bpp * len(points) - points[:, 0, 1].sum()
+    blocked = np.zeros(len(points), dtype=bool)
+
+    for segment in np.lexsort((starts, -slopes)):
+        hull_id = hull_ids[segment]
+
+        if blocked[hull_id]:
+            continue
+
+        if rates[segment] <= budget:
+            budget -= rates[segment]
+            chosen[hull_id] = starts[segment] + 1
+        else:
+            blocked[hull_id] = True
+
+    mode_ids = [int(mode_id) for mode_id in points[np.arange(len(points)), chosen, 0]]
 
     return mode_ids
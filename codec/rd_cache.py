@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from helpers.hashing import cached_file_hash, text_hash
+from helpers.paths import FILE_HASHES_PATH, atomic_write, rd_hulls_cache_path
+from codec.models import Config
+from codec.rd import pad_hulls
+
+# bump when RD hulls computed for the same sequence and config change
+RD_CACHE_VERSION = 1
+
+
+class RdHullsCache:
+    def __init__(self, sequence_path, config: Config):
+        key = f'{cached_file_hash(sequence_path, FILE_HASHES_PATH)}__{config.block}__{config.encoding_type.name}__{config.decoding_type.name}__{config.chroma_type.name}__{RD_CACHE_VERSION}'
+
+        self.path = rd_hulls_cache_path(sequence_path, text_hash(key)[:16])
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+
+        with np.load(self.path) as data:
+            parts_count = len(data.files) // 2
+
+            return [
+                [points[valid] for points, valid in zip(data[f'points_{i}'], data[f'valid_{i}'])]
+                for i in range(parts_count)]
+
+    def save(self, parts_hulls):
+        arrays = {}
+
+        for i, hulls in enumerate(parts_hulls):
+            arrays[f'points_{i}'], arrays[f'valid_{i}'] = pad_hulls(hulls)
+
+        with atomic_write(self.path, 'wb') as file:
+            np.savez(file, **arrays)
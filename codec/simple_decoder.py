@@ -1,66 +1,96 @@
+from functools import lru_cache
+
 import numpy as np
-from scipy.ndimage import map_coordinates
 
 from helpers.array_iterator import ArrayIterator
-from helpers.numpy_extensions import repeat_3d
-from helpers.paths import metadata_path, decoded_sequence_path
+from helpers.numpy_extensions import interpolate_separable_3d, linear_weights, merge_blocks, pick_last_samples, repeat_3d
+from helpers.tracing import traced
+from codec.decoder import Decoder
 from codec.models import Config, Shape3D, SamplingMode, DecodingType
-from yuv_io.yuv_writer import YuvWriter
 
 
-class SimpleDecoder:
-    def __init__(self, code_path, config: Config):
+class SimpleDecoder(Decoder):
+    def __init__(self, code_path, config: Config, source_shape=None):
+        super().__init__(code_path, config, source_shape)
+
         decoding_functions = {
             DecodingType.REPEAT: SimpleDecoder.repeat_samples,
             DecodingType.INTERPOLATE: SimpleDecoder.interpolate_average_samples
         }
 
-        self.config = config
         self.decoding_function = decoding_functions[config.decoding_type]
-        
-        with open(code_path, 'rb') as file:
-            self.code = ArrayIterator(np.fromfile(file, dtype=np.uint8))
 
-        with open(metadata_path(code_path), 'rb') as file:
-            self.source_rows = np.fromfile(file, dtype=np.uint16, count=1)[0]
-            self.source_cols = np.fromfile(file, dtype=np.uint16, count=1)[0]
-            self.metadata = ArrayIterator(np.fromfile(file, dtype=np.uint8))
+    @traced('decode part')
+    def decode_part(self, code_stream: ArrayIterator, metadata: ArrayIterator):
+        uv_subsampling = self.config.uv_subsampling
+        uv_rows, uv_cols = self.source_rows // uv_subsampling.rows, self.source_cols // uv_subsampling.cols
+
+        groups = self.config.get_blocks_groups(self.source_rows, self.source_cols)
+        groups_modes = [self.config.get_modes(shape) for _, _, shape in groups]
+        blocks_count = sum(len(indices) for indices, _, _ in groups)
+
+        y_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
+        u_part = np.empty((uv_rows, uv_cols, self.config.block.frames), dtype=np.uint8)
+        v_part = np.empty((uv_rows, uv_cols, self.config.block.frames), dtype=np.uint8)
+
+        # code of every block starts where code of previous one in row-major order ends
+        mode_ids = metadata.get_many((blocks_count,))
+        code_lengths = np.zeros(blocks_count, dtype=int)
+
+        for (indices, _, _), modes in zip(groups, groups_modes):
+            mode_lengths = np.zeros(len(self.config.chunks), dtype=int)
+            mode_lengths[[mode.idx for mode in modes]] = [mode.y_points.count + 2 * mode.uv_points.count for mode in modes]
+
+            code_lengths[indices] = mode_lengths[mode_ids[indices]]
+
+        code_starts = np.cumsum(code_lengths) - code_lengths
+        code = code_stream.get_many((code_lengths.sum(),))
+
+        # blocks of the same shape and mode are decoded together
+        for (indices, (r0, r1, c0, c1), shape), modes in zip(groups, groups_modes):
+            uv_shape = shape // uv_subsampling
 
-        self.writer = YuvWriter(decoded_sequence_path(code_path))
+            y_blocks = np.empty((len(indices), *shape.as_tuple()), dtype=np.uint8)
+            u_blocks = np.empty((len(indices), *uv_shape.as_tuple()), dtype=np.uint8)
+            v_blocks = np.empty((len(indices), *uv_shape.as_tuple()), dtype=np.uint8)
 
-    def decode(self):
-        while self.code.has_next():
-            y_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
-            u_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
-            v_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
+            group_mode_ids = mode_ids[indices]
+            group_code_starts = code_starts[indices]
 
-            for r in range(0, self.source_rows, self.config.block.rows):
-                for c in range(0, self.source_cols, self.config.block.cols):
-                    block = Shape3D(
-                        min(self.config.block.rows, self.source_rows - r),
-                        min(self.config.block.cols, self.source_cols - c),
-                        self.config.block.frames)
+            for mode in modes:
+                selected = np.flatnonzero(group_mode_ids == mode.idx)
 
-                    mode_id = self.metadata.get()
-                    mode = self.config.get_mode(mode_id, block)
+                if selected.size == 0:
+                    continue
 
-                    y_code = self.code.get_many(mode.y_points.as_tuple())
-                    u_code = self.code.get_many(mode.uv_points.as_tuple())
-                    v_code = self.code.get_many(mode.uv_points.as_tuple())
+                y_size, uv_size = mode.y_points.count, mode.uv_points.count
+                mode_code = code[group_code_starts[selected, None] + np.arange(y_size + 2 * uv_size)]
 
-                    y_block, u_block, v_block = self.decoding_function(y_code, u_code, v_code, mode)
+                y_code = mode_code[:, :y_size].reshape(-1, *mode.y_points.as_tuple())
+                u_code = mode_code[:, y_size:y_size+uv_size].reshape(-1, *mode.uv_points.as_tuple())
+                v_code = mode_code[:, y_size+uv_size:].reshape(-1, *mode.uv_points.as_tuple())
 
-                    y_part[r:r+block.rows, c:c+block.cols, :] = y_block
-                    u_part[r:r+block.rows, c:c+block.cols, :] = u_block
-                    v_part[r:r+block.rows, c:c+block.cols, :] = v_block
+                y_blocks[selected], u_blocks[selected], v_blocks[selected] = self.decoding_function(y_code, u_code, v_code, mode)
 
-            for i in range(self.config.block.frames):
-                frame = np.dstack((y_part[:, :, i], u_part[:, :, i], v_part[:, :, i]))
-                self.writer.write_next(frame)
+            blocks_in_group = Shape3D((r1 - r0) // shape.rows, (c1 - c0) // shape.cols, 1)
+            uv_r0, uv_r1 = r0 // uv_subsampling.rows, r1 // uv_subsampling.rows
+            uv_c0, uv_c1 = c0 // uv_subsampling.cols, c1 // uv_subsampling.cols
 
-        self.writer.close()
+            y_part[r0:r1, c0:c1, :] = merge_blocks(y_blocks, blocks_in_group)
+            u_part[uv_r0:uv_r1, uv_c0:uv_c1, :] = merge_blocks(u_blocks, blocks_in_group)
+            v_part[uv_r0:uv_r1, uv_c0:uv_c1, :] = merge_blocks(v_blocks, blocks_in_group)
+
+        # full size chroma is brought back to 4:2:0 the same way as in YuvWriter
+        u_part = pick_last_samples(u_part, Shape3D(2, 2, 1) // uv_subsampling)
+        v_part = pick_last_samples(v_part, Shape3D(2, 2, 1) // uv_subsampling)
+
+        for i in range(self.config.block.frames):
+            self.writer.write_next_planes(y_part[:, :, i], u_part[:, :, i], v_part[:, :, i])
+
+        return y_part, u_part, v_part
 
     @staticmethod
+    @traced('repeat samples')
     def repeat_samples(y_input, u_input, v_input, mode: SamplingMode):
         y_block = repeat_3d(y_input, mode.y_chunk)
         u_block = repeat_3d(u_input, mode.uv_chunk)
@@ -69,15 +99,22 @@ class SimpleDecoder:
         return y_block, u_block, v_block
 
     @staticmethod
+    @traced('interpolate samples')
     def interpolate_average_samples(y_input, u_input, v_input, mode: SamplingMode):
-        y_rows_coord = np.linspace(0.5, mode.block.rows-0.5, mode.block.rows) / mode.y_chunk.rows - 0.5
-        y_cols_coord = np.linspace(0.5, mode.block.cols-0.5, mode.block.cols) / mode.y_chunk.cols - 0.5
-        y_frames_coord = np.linspace(0.5, mode.block.frames-0.5, mode.block.frames) / mode.y_chunk.frames - 0.5
-
-        y_coord = np.stack(np.meshgrid(y_rows_coord, y_cols_coord, y_frames_coord, indexing='ij'))
-
-        y_block = map_coordinates(y_input, y_coord, order=1, mode='nearest')
+        y_block = interpolate_separable_3d(y_input, *SimpleDecoder.average_interpolation_weights(mode.block, mode.y_chunk))
         u_block = repeat_3d(u_input, mode.uv_chunk)
         v_block = repeat_3d(v_input, mode.uv_chunk)
 
         return y_block, u_block, v_block
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def average_interpolation_weights(block: Shape3D, chunk: Shape3D):
+        # averages lie in centers of their chunks, weights depend only on shapes of block and chunk
+        weights = []
+
+        for size, chunk_size in zip(block.as_tuple(), chunk.as_tuple()):
+            coordinates = np.linspace(0.5, size-0.5, size) / chunk_size - 0.5
+            weights.append(linear_weights(coordinates, size // chunk_size))
+
+        return tuple(weights)
@@ -1,16 +1,19 @@
 import numpy as np
-from skimage.metrics import mean_squared_error
 
-from helpers.numpy_extensions import averages_3d, pick_last_samples
-from helpers.paths import code_path, metadata_path
+from helpers.average_pyramid import AveragePyramid
+from helpers.numpy_extensions import pick_last_samples, split_into_blocks, squared_errors_sum, squares_sum
+from helpers.tracing import traced
 from codec.simple_decoder import SimpleDecoder
-from codec.rd import bisection, convex_hull
-from codec.models import Config, BlockEncodingData, Shape3D, SamplingMode, EncodingType
+from codec.encoder import Encoder
+from codec.rd import convex_hulls
+from codec.models import Config, BlockEncodingData, Shape3D, SamplingMode, EncodingType, ChromaType
 from yuv_io.yuv_reader import YuvReader
 
 
-class SimpleEncoder:
+class SimpleEncoder(Encoder):
     def __init__(self, sequence_path, config: Config):
+        super().__init__(sequence_path, config)
+
         encoding_functions = {
             EncodingType.PICK_REPEAT: self.pick_samples,
             EncodingType.AVERAGE_REPEAT: self.get_average_samples,
@@ -23,82 +26,138 @@ class SimpleEncoder:
             EncodingType.AVERAGE_INTERPOLATE: SimpleDecoder.interpolate_average_samples
         }
 
-        self.encoding_function = encoding_functions[config.encoding_type]
-        self.decoding_function = decoding_functions[config.encoding_type]
-        self.config = config
+        sources_functions = {
+            EncodingType.PICK_REPEAT: self.get_blocks,
+            EncodingType.AVERAGE_REPEAT: self.get_average_pyramids,
+            EncodingType.AVERAGE_INTERPOLATE: self.get_average_pyramids
+        }
 
-        self.source_reader = YuvReader(sequence_path)
-        self.source_rows, self.source_cols = self.source_reader.y_shape
+        distortion_functions = {
+            EncodingType.PICK_REPEAT: self.get_squared_errors,
+            EncodingType.AVERAGE_REPEAT: self.get_average_repeat_squared_errors,
+            EncodingType.AVERAGE_INTERPOLATE: self.get_squared_errors
+        }
 
-        self.code_writer = open(code_path(sequence_path, config.name), 'wb')
-        self.metadata_writer = open(metadata_path(sequence_path, config.name), 'wb')
+        self.encoding_function = encoding_functions[config.encoding_type]
+        self.decoding_function = decoding_functions[config.encoding_type]
+        self.sources_function = sources_functions[config.encoding_type]
+        self.distortion_function = distortion_functions[config.encoding_type]
 
-    def encode(self):
-        self.metadata_writer.write(self.source_rows.to_bytes(2, 'little'))
-        self.metadata_writer.write(self.source_cols.to_bytes(2, 'little'))
+    def read_parts(self, source_reader: YuvReader):
+        uv_subsampling = self.config.uv_subsampling
+        uv_rows, uv_cols = self.source_rows // uv_subsampling.rows, self.source_cols // uv_subsampling.cols
 
         while True:
             y_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
-            u_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
-            v_part = np.empty((self.source_rows, self.source_cols, self.config.block.frames), dtype=np.uint8)
+            u_part = np.empty((uv_rows, uv_cols, self.config.block.frames), dtype=np.uint8)
+            v_part = np.empty((uv_rows, uv_cols, self.config.block.frames), dtype=np.uint8)
 
             for i in range(self.config.block.frames):
-                frame = self.source_reader.read_next()
+                planes = source_reader.read_next_planes(upsample_uv=self.config.chroma_type == ChromaType.FULL_SIZE)
 
-                if frame is None:
-                    self.code_writer.close()
-                    self.metadata_writer.close()
+                if planes is None:
                     return
 
-                y_part[:, :, i] = frame[:, :, 0]
-                u_part[:, :, i] = frame[:, :, 1]
-                v_part[:, :, i] = frame[:, :, 2]
+                y_part[:, :, i], u_part[:, :, i], v_part[:, :, i] = planes
 
-            params = []
+            yield y_part, u_part, v_part
 
-            for r in range(0, self.source_rows, self.config.block.rows):
-                for c in range(0, self.source_cols, self.config.block.cols):
-                    block = Shape3D(
-                        min(self.config.block.rows, self.source_rows - r),
-                        min(self.config.block.cols, self.source_cols - c),
-                        self.config.block.frames)
+    def split_part_into_groups(self, y_part, u_part, v_part):
+        uv_subsampling = self.config.uv_subsampling
+        groups = []
 
-                    y_block = y_part[r:r+block.rows, c:c+block.cols, :]
-                    u_block = u_part[r:r+block.rows, c:c+block.cols, :]
-                    v_block = v_part[r:r+block.rows, c:c+block.cols, :]
+        for indices, (r0, r1, c0, c1), shape in self.config.get_blocks_groups(self.source_rows, self.source_cols):
+            uv_r0, uv_r1 = r0 // uv_subsampling.rows, r1 // uv_subsampling.rows
+            uv_c0, uv_c1 = c0 // uv_subsampling.cols, c1 // uv_subsampling.cols
 
-                    params.append(BlockEncodingData(y_block, u_block, v_block, block))
+            y_blocks = split_into_blocks(y_part[r0:r1, c0:c1, :], shape)
+            u_blocks = split_into_blocks(u_part[uv_r0:uv_r1, uv_c0:uv_c1, :], shape // uv_subsampling)
+            v_blocks = split_into_blocks(v_part[uv_r0:uv_r1, uv_c0:uv_c1, :], shape // uv_subsampling)
 
-            hulls = [self.get_rd_hull_for_block(args) for args in params]
-            mode_ids = bisection(hulls, self.config.target_bpp)
+            groups.append((indices, BlockEncodingData(y_blocks, u_blocks, v_blocks, shape)))
 
-            for data, mode_id in zip(params, mode_ids):
-                mode = self.config.get_mode(mode_id, data.block)
+        return groups
 
-                y_encoded, u_encoded, v_encoded = self.encoding_function(data.y_block, data.u_block, data.v_block, mode)
-                code = self.get_code(y_encoded, u_encoded, v_encoded)
+    @traced('rd hulls')
+    def get_rd_hulls_for_blocks(self, data: BlockEncodingData):
+        modes = self.config.get_modes(data.block)
+        sources = self.sources_function(data)
+        rd = np.empty((len(data.y_block), len(modes), 3))
 
-                self.code_writer.write(code)
-                self.metadata_writer.write(mode_id.to_bytes(1, 'little'))
+        rd[:, :, 0] = [mode.idx for mode in modes]
+        rd[:, :, 1] = [mode.rate for mode in modes]  # R
+        rd[:, :, 2] = self.distortion_function(data, sources, modes) / (data.block.count * 3)  # D
 
-    def get_rd_hull_for_block(self, data: BlockEncodingData):
-        modes = self.config.get_modes(data.block)
-        rd = np.empty((len(modes), 3))
+        return convex_hulls(rd)
+
+    @traced('codes')
+    def get_codes_for_blocks(self, data: BlockEncodingData, mode_ids):
+        sources = self.sources_function(data)
+        codes = [None] * len(mode_ids)
+
+        for mode in self.config.get_modes(data.block):
+            selected = [idx for idx, mode_id in enumerate(mode_ids) if mode_id == mode.idx]
+
+            if not selected:
+                continue
+
+            y_encoded, u_encoded, v_encoded = self.encoding_function(*sources, mode)
+
+            for idx in selected:
+                codes[idx] = self.get_code(y_encoded[idx], u_encoded[idx], v_encoded[idx])
+
+        return codes
+
+    def get_squared_errors(self, data: BlockEncodingData, sources, modes):
+        squared_errors = np.empty((len(data.y_block), len(modes)), dtype=np.int64)
 
         for idx, mode in enumerate(modes):
-            y_encoded, u_encoded, v_encoded = self.encoding_function(data.y_block, data.u_block, data.v_block, mode)
+            y_encoded, u_encoded, v_encoded = self.encoding_function(*sources, mode)
             y_decoded, u_decoded, v_decoded = self.decoding_function(y_encoded, u_encoded, v_encoded, mode)
 
-            merged_source = np.hstack((data.y_block, data.u_block, data.v_block))
-            merged_decoded = np.hstack((y_decoded, u_decoded, v_decoded))
+            squared_errors[:, idx] = \
+                squared_errors_sum(data.y_block, y_decoded) + self.config.uv_weight * (
+                    squared_errors_sum(data.u_block, u_decoded) +
+                    squared_errors_sum(data.v_block, v_decoded))
+
+        return squared_errors
+
+    def get_average_repeat_squared_errors(self, data: BlockEncodingData, sources, modes):
+        # sum of squared errors of a chunk repeated from its truncated average a is Q - a * (2S - n * a),
+        # where S and Q are sums of samples and squared samples and n is number of samples in chunk
+        y_pyramid, u_pyramid, v_pyramid = sources
+        uv_weight = self.config.uv_weight
+        squares = squares_sum(data.y_block) + uv_weight * (squares_sum(data.u_block) + squares_sum(data.v_block))
+
+        squared_errors = np.empty((len(data.y_block), len(modes)), dtype=np.int64)
+
+        for idx, mode in enumerate(modes):
+            squared_errors[:, idx] = squares - \
+                SimpleEncoder.repeated_averages_error_reduction(y_pyramid.sums(mode.y_chunk), mode.y_chunk) - uv_weight * (
+                    SimpleEncoder.repeated_averages_error_reduction(u_pyramid.sums(mode.uv_chunk), mode.uv_chunk) +
+                    SimpleEncoder.repeated_averages_error_reduction(v_pyramid.sums(mode.uv_chunk), mode.uv_chunk))
+
+        return squared_errors
+
+    @staticmethod
+    def repeated_averages_error_reduction(sums, chunk: Shape3D):
+        return np.sum(SimpleEncoder.repeated_average_error_reductions(sums, chunk), axis=(-3, -2, -1))
 
-            rd[idx, 0] = mode.idx
-            rd[idx, 1] = mode.rate  # R
-            rd[idx, 2] = mean_squared_error(merged_source, merged_decoded)  # D
+    @staticmethod
+    def repeated_average_error_reductions(sums, chunk: Shape3D):
+        # reduction of each chunk separately
+        sums = sums.astype(np.int64)
+        averages = sums // chunk.count
 
-        rd = convex_hull(rd)
+        return averages * (2 * sums - chunk.count * averages)
 
-        return rd
+    @staticmethod
+    def get_blocks(data: BlockEncodingData):
+        return data.y_block, data.u_block, data.v_block
+
+    @staticmethod
+    def get_average_pyramids(data: BlockEncodingData):
+        return AveragePyramid(data.y_block), AveragePyramid(data.u_block), AveragePyramid(data.v_block)
 
     @staticmethod
     def pick_samples(y_block, u_block, v_block, mode: SamplingMode):
@@ -109,10 +168,10 @@ class SimpleEncoder:
         return y_samples, u_samples, v_samples
 
     @staticmethod
-    def get_average_samples(y_block, u_block, v_block, mode: SamplingMode):
-        y_samples = averages_3d(y_block, mode.y_chunk, mode.y_points)
-        u_samples = averages_3d(u_block, mode.uv_chunk, mode.uv_points)
-        v_samples = averages_3d(v_block, mode.uv_chunk, mode.uv_points)
+    def get_average_samples(y_pyramid: AveragePyramid, u_pyramid: AveragePyramid, v_pyramid: AveragePyramid, mode: SamplingMode):
+        y_samples = y_pyramid.averages(mode.y_chunk)
+        u_samples = u_pyramid.averages(mode.uv_chunk)
+        v_samples = v_pyramid.averages(mode.uv_chunk)
 
         return y_samples, u_samples, v_samples
 
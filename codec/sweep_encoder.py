@@ -0,0 +1,257 @@
+from contextlib import ExitStack
+from math import gcd
+
+import numpy as np
+
+from helpers.average_pyramid import AveragePyramid
+from helpers.numpy_extensions import chunk_sums
+from helpers.parallel import ordered_map
+from helpers.paths import code_path, metadata_path, video_shape
+from helpers.tracing import traced
+from codec.simple_encoder import SimpleEncoder
+from codec.rd import convex_hulls
+from codec.models import Config, Shape3D, EncodingType, ChromaType
+from yuv_io.yuv_reader import YuvReader
+
+
+# Group of blocks with the same shape in all shorter parts of one config which fit into a part of the sweep,
+# blocks are ordered by their shorter part first and then in row-major order, like they are written.
+class BlocksGroup:
+    def __init__(self, indices, region, shape: Shape3D, parts: int, config: Config):
+        self.indices = indices
+        self.region = region
+        self.shape = shape
+        self.parts = parts
+        self.modes = config.get_modes(shape)
+
+        self.y_columns = {mode.y_chunk.as_tuple(): idx for idx, mode in enumerate(self.modes)}
+        self.uv_columns = {mode.uv_chunk.as_tuple(): idx for idx, mode in enumerate(self.modes)}
+
+        self.squared_errors = None
+        self.mode_ids = None
+        self.codes = None
+
+    def cut(self, sums, chunk: Shape3D, subsampling: Shape3D):
+        # sums of chunks lying inside the group region of a plane subsampled by given factors, stacked by blocks
+        r0, r1, c0, c1 = self.region
+        rows_step, cols_step = chunk.rows * subsampling.rows, chunk.cols * subsampling.cols
+        points = self.shape // subsampling // chunk
+
+        region_sums = sums[r0//rows_step:r1//rows_step, c0//cols_step:c1//cols_step, :self.parts*points.frames]
+        rows, cols, frames = region_sums.shape
+
+        region_sums = region_sums.reshape(rows // points.rows, points.rows, cols // points.cols, points.cols, self.parts, points.frames)
+
+        return region_sums.transpose(4, 0, 2, 1, 3, 5).reshape(-1, *points.as_tuple())
+
+    def part_slice(self, part_idx):
+        return slice(part_idx * len(self.indices), (part_idx + 1) * len(self.indices))
+
+
+# Encodes a sequence with several AVERAGE_REPEAT configs which differ only in block shape. Parts span the longest
+# block, so every shorter one fits a whole number of times into them. Chunk sums of every part come from one pyramid
+# per plane and are cut into blocks of all shapes, so levels are computed once per part instead of once per shape.
+# Output of every config is the same as the one of SimpleEncoder.
+class SweepEncoder:
+    def __init__(self, sequence_path, configs):
+        if any(config.encoding_type != EncodingType.AVERAGE_REPEAT for config in configs):
+            raise ValueError('Sweep supports only average_repeat encoding')
+
+        # planes, weights and allocation are shared by all configs, only settings which do not change the code may differ
+        if len({self.coding_settings(config) for config in configs}) > 1:
+            raise ValueError('Sweep configs have to differ only in block shape')
+
+        self.encoders = [SimpleEncoder(sequence_path, config) for config in configs]
+        self.configs = configs
+
+        self.sequence_path = sequence_path
+        self.source_rows, self.source_cols = video_shape(sequence_path)
+        self.frames = max(config.block.frames for config in configs)
+        self.workers = max(config.workers for config in configs)
+
+        # subsampling and weight of distortion of Y, U and V planes
+        self.planes_subsampling = [Shape3D(1, 1, 1), configs[0].uv_subsampling, configs[0].uv_subsampling]
+        self.planes_weights = [1, configs[0].uv_weight, configs[0].uv_weight]
+
+        # squared samples are summed in chunks which tile blocks of all shapes, including the ones on the edges
+        self.squares_chunk = Shape3D(
+            gcd(self.source_rows, *[config.block.rows for config in configs]),
+            gcd(self.source_cols, *[config.block.cols for config in configs]),
+            gcd(*[config.block.frames for config in configs]))
+
+    @staticmethod
+    def coding_settings(config: Config):
+        return config.target_bpp, config.encoding_type, config.decoding_type, config.allocation_type, config.chroma_type
+
+    def encode(self):
+        source_reader = YuvReader(self.sequence_path)
+
+        with ExitStack() as stack:
+            writers = []
+
+            for config in self.configs:
+                code_writer = stack.enter_context(open(code_path(self.sequence_path, config.name), 'wb'))
+                metadata_writer = stack.enter_context(open(metadata_path(self.sequence_path, config.name), 'wb'))
+
+                metadata_writer.write(self.source_rows.to_bytes(2, 'little'))
+                metadata_writer.write(self.source_cols.to_bytes(2, 'little'))
+
+                writers.append((code_writer, metadata_writer))
+
+            for encoded_parts in ordered_map(self.encode_part, self.read_parts(source_reader), self.workers):
+                for (code_writer, metadata_writer), parts in zip(writers, encoded_parts):
+                    for code, metadata in parts:
+                        code_writer.write(code)
+                        metadata_writer.write(metadata)
+
+    def read_parts(self, source_reader: YuvReader):
+        uv_subsampling = self.planes_subsampling[1]
+        uv_rows, uv_cols = self.source_rows // uv_subsampling.rows, self.source_cols // uv_subsampling.cols
+
+        while True:
+            y_part = np.empty((self.source_rows, self.source_cols, self.frames), dtype=np.uint8)
+            u_part = np.empty((uv_rows, uv_cols, self.frames), dtype=np.uint8)
+            v_part = np.empty((uv_rows, uv_cols, self.frames), dtype=np.uint8)
+
+            for i in range(self.frames):
+                planes = source_reader.read_next_planes(upsample_uv=self.configs[0].chroma_type == ChromaType.FULL_SIZE)
+
+                # last part may still hold whole parts of shorter blocks
+                if planes is None:
+                    if i > 0:
+                        yield y_part[:, :, :i], u_part[:, :, :i], v_part[:, :, :i]
+
+                    return
+
+                y_part[:, :, i], u_part[:, :, i], v_part[:, :, i] = planes
+
+            yield y_part, u_part, v_part
+
+    @traced('encode part')
+    def encode_part(self, part):
+        pyramids = [AveragePyramid(plane) for plane in part]
+        frames = part[0].shape[2]
+
+        configs_groups = [
+            [
+                BlocksGroup(indices, region, shape, frames // encoder.config.block.frames, encoder.config)
+                for indices, region, shape in encoder.config.get_blocks_groups(self.source_rows, self.source_cols)]
+            for encoder in self.encoders]
+
+        groups = [group for config_groups in configs_groups for group in config_groups if group.parts > 0]
+
+        self.calculate_squared_errors(part, pyramids, groups)
+
+        for encoder, config_groups in zip(self.encoders, configs_groups):
+            if config_groups[0].parts > 0:
+                self.choose_modes(encoder, config_groups)
+
+        self.calculate_codes(pyramids, groups)
+
+        return [self.join_codes(config_groups) for config_groups in configs_groups]
+
+    @traced('squared errors')
+    def calculate_squared_errors(self, part, pyramids, groups):
+        for group in groups:
+            group.squared_errors = np.zeros((group.parts * len(group.indices), len(group.modes)), dtype=np.int64)
+
+        for plane, subsampling, weight in zip(part, self.planes_subsampling, self.planes_weights):
+            squares_chunk = self.squares_chunk // subsampling
+            squares = chunk_sums(plane.astype(np.uint32) ** 2, squares_chunk, np.int64)
+
+            for group in groups:
+                group.squared_errors += weight * np.sum(group.cut(squares, squares_chunk, subsampling), axis=(-3, -2, -1))[:, None]
+
+        # every level of the pyramid is used by all groups before the next one is computed
+        for plane_idx, pyramid in enumerate(pyramids):
+            columns_name = 'y_columns' if plane_idx == 0 else 'uv_columns'
+            subsampling, weight = self.planes_subsampling[plane_idx], self.planes_weights[plane_idx]
+
+            for chunk in sorted({chunk for group in groups for chunk in getattr(group, columns_name)}):
+                chunk = Shape3D(*chunk)
+                reductions = SimpleEncoder.repeated_average_error_reductions(pyramid.sums(chunk), chunk)
+
+                for group in groups:
+                    idx = getattr(group, columns_name).get(chunk.as_tuple())
+
+                    if idx is not None:
+                        group.squared_errors[:, idx] -= weight * np.sum(group.cut(reductions, chunk, subsampling), axis=(-3, -2, -1))
+
+    @staticmethod
+    @traced('allocation')
+    def choose_modes(encoder: SimpleEncoder, config_groups):
+        groups_hulls = []
+
+        for group in config_groups:
+            rd = np.empty((len(group.squared_errors), len(group.modes), 3))
+
+            rd[:, :, 0] = [mode.idx for mode in group.modes]
+            rd[:, :, 1] = [mode.rate for mode in group.modes]  # R
+            rd[:, :, 2] = group.squared_errors / (group.shape.count * 3)  # D
+
+            groups_hulls.append(convex_hulls(rd))
+            group.mode_ids = np.empty(len(group.squared_errors), dtype=int)
+
+        # modes are allocated separately in every shorter part
+        for part_idx in range(config_groups[0].parts):
+            hulls = [None] * sum(len(group.indices) for group in config_groups)
+
+            for group, group_hulls in zip(config_groups, groups_hulls):
+                for idx, hull in zip(group.indices, group_hulls[group.part_slice(part_idx)]):
+                    hulls[idx] = hull
+
+            mode_ids = np.array(encoder.allocation_function(hulls, encoder.config.target_bpp))
+
+            for group in config_groups:
+                group.mode_ids[group.part_slice(part_idx)] = mode_ids[group.indices]
+
+    @traced('codes')
+    def calculate_codes(self, pyramids, groups):
+        for group in groups:
+            group.codes = [[None] * len(pyramids) for _ in group.mode_ids]
+
+        for plane_idx, pyramid in enumerate(pyramids):
+            columns_name = 'y_columns' if plane_idx == 0 else 'uv_columns'
+            groups_columns = [getattr(group, columns_name) for group in groups]
+            subsampling = self.planes_subsampling[plane_idx]
+
+            used_chunks = {
+                chunk
+                for group, columns in zip(groups, groups_columns)
+                for chunk, idx in columns.items()
+                if np.any(group.mode_ids == group.modes[idx].idx)}
+
+            for chunk in sorted(used_chunks):
+                chunk = Shape3D(*chunk)
+                sums = pyramid.sums(chunk)
+
+                for group, columns in zip(groups, groups_columns):
+                    idx = columns.get(chunk.as_tuple())
+                    selected = np.flatnonzero(group.mode_ids == group.modes[idx].idx) if idx is not None else []
+
+                    if len(selected) == 0:
+                        continue
+
+                    averages = (group.cut(sums, chunk, subsampling)[selected] // chunk.count).astype(np.uint8)
+
+                    for block_idx, block_averages in zip(selected, averages):
+                        group.codes[block_idx][plane_idx] = block_averages.flatten()
+
+    @staticmethod
+    def join_codes(config_groups):
+        encoded_parts = []
+
+        for part_idx in range(config_groups[0].parts):
+            codes = [None] * sum(len(group.indices) for group in config_groups)
+            mode_ids = [None] * len(codes)
+
+            for group in config_groups:
+                part_slice = group.part_slice(part_idx)
+
+                for idx, block_codes, mode_id in zip(group.indices, group.codes[part_slice], group.mode_ids[part_slice]):
+                    codes[idx] = np.hstack(block_codes)
+                    mode_ids[idx] = int(mode_id)
+
+            encoded_parts.append((np.hstack(codes), bytes(mode_ids)))
+
+        return encoded_parts
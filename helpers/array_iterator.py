@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 
 
@@ -21,3 +23,12 @@ class ArrayIterator:
 
     def has_next(self):
         return self.position < self.data.size
+
+
+def file_bytes(file_path, memory_map=False):
+    # memory mapped bytes are read from disk only when accessed, slices of them are views into the mapping
+    if memory_map and os.path.getsize(file_path) > 0:
+        return np.asarray(np.memmap(file_path, dtype=np.uint8, mode='r'))
+
+    with open(file_path, 'rb') as file:
+        return np.fromfile(file, dtype=np.uint8)
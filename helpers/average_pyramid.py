@@ -0,0 +1,47 @@
+import numpy as np
+
+from codec.models import Shape3D
+
+
+# Sums of power-of-two chunks over the last three axes, each level built by merging pairs of chunks from a finer one.
+# Only levels needed to continue Config.generate_chunks order are kept, so walking modes in that order computes
+# every level once while holding just a few of them in memory.
+class AveragePyramid:
+    def __init__(self, array):
+        self.levels = {(1, 1, 1): array}
+
+    def sums(self, chunk: Shape3D):
+        key = chunk.as_tuple()
+
+        if key not in self.levels:
+            rows, cols, frames = key
+
+            if frames > 1:
+                parent, axis = Shape3D(rows, cols, frames // 2), -1
+            elif cols > 1:
+                parent, axis = Shape3D(rows, cols // 2, frames), -2
+            else:
+                parent, axis = Shape3D(rows // 2, cols, frames), -3
+
+            parent_sums = self.sums(parent)
+            spine = [(1, 1, 1), (rows, 1, 1), (rows, cols, 1)]
+
+            self.levels = {level: sums for level, sums in self.levels.items() if level in spine}
+            self.levels[key] = self.merge_pairs(parent_sums, axis, np.uint16 if chunk.count <= 257 else np.uint32)
+
+        return self.levels[key]
+
+    def averages(self, chunk: Shape3D):
+        return (self.sums(chunk) // chunk.count).astype(np.uint8)
+
+    @staticmethod
+    def merge_pairs(array, axis, dtype):
+        # odd chunk left at the end of an axis has no pair and is dropped
+        end = array.shape[axis] // 2 * 2
+
+        first = [slice(None)] * array.ndim
+        second = [slice(None)] * array.ndim
+        first[axis] = slice(0, end, 2)
+        second[axis] = slice(1, end, 2)
+
+        return np.add(array[tuple(first)], array[tuple(second)], dtype=dtype)
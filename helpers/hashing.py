@@ -0,0 +1,36 @@
+import hashlib
+import json
+import os
+
+from helpers.paths import atomic_write
+
+
+def file_hash(file_path, chunk_size=2**24):
+    sha = hashlib.sha1()
+
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def cached_file_hash(file_path, cache_path):
+    # hash is computed again only when size or modification time of the file changes
+    stat = os.stat(file_path)
+    stamp = f'{stat.st_size}__{stat.st_mtime_ns}'
+    key = os.path.abspath(file_path)
+
+    cache = json.load(open(cache_path)) if os.path.exists(cache_path) else {}
+
+    if cache.get(key, {}).get('stamp') != stamp:
+        cache[key] = {'stamp': stamp, 'hash': file_hash(file_path)}
+
+        with atomic_write(cache_path) as file:
+            json.dump(cache, file, indent=4)
+
+    return cache[key]['hash']
@@ -1,3 +1,6 @@
+from functools import lru_cache
+from math import gcd
+
 import numpy as np
 from scipy.ndimage import zoom
 
@@ -5,11 +8,11 @@ from codec.models import Shape3D
 
 
 def pick_first_samples(array, chunk: Shape3D):
-    return array[::chunk.rows, ::chunk.cols, ::chunk.frames]
+    return array[..., ::chunk.rows, ::chunk.cols, ::chunk.frames]
 
 
 def pick_last_samples(array, chunk: Shape3D):
-    return array[chunk.rows-1::chunk.rows, chunk.cols-1::chunk.cols, chunk.frames-1::chunk.frames]
+    return array[..., chunk.rows-1::chunk.rows, chunk.cols-1::chunk.cols, chunk.frames-1::chunk.frames]
 
 
 def repeat_2d(array, zoom_shape):
@@ -23,26 +26,162 @@ def repeat_2d(array, zoom_shape):
 
 
 def repeat_3d(array, zoom_shape: Shape3D):
-    rows, cols, frames = array.shape
+    *batch, rows, cols, frames = array.shape
     rows_zoom, cols_zoom, frames_zoom = zoom_shape.rows, zoom_shape.cols, zoom_shape.frames
 
-    result = np.empty((rows, rows_zoom, cols, cols_zoom, frames, frames_zoom), array.dtype)
-    result[...] = array[:, None, :, None, :, None]
+    result = np.empty((*batch, rows, rows_zoom, cols, cols_zoom, frames, frames_zoom), array.dtype)
+    result[...] = array[..., :, None, :, None, :, None]
 
-    return result.reshape(rows * rows_zoom, cols * cols_zoom, frames * frames_zoom)
+    return result.reshape(*batch, rows * rows_zoom, cols * cols_zoom, frames * frames_zoom)
 
 
 def zoom_3d(array, target_shape: Shape3D):
-    zoom_factors = np.array(target_shape.as_tuple()) / array.shape
-    zoomed = zoom(array, zoom_factors, order=1)
+    # linear zoom of the last three axes with corners of input and output aligned, same as scipy.ndimage.zoom(order=1),
+    # when every coordinate is a dyadic fraction the separable weights give exactly the same samples, otherwise
+    # scipy sums the corners in its own order and rounds differently at ties, so it is used itself
+    shape = array.shape[-3:]
+
+    if all(is_dyadic_zoom(size, target_size) for size, target_size in zip(shape, target_shape.as_tuple())):
+        weights = [zoom_weights(size, target_size) for size, target_size in zip(shape, target_shape.as_tuple())]
+
+        return interpolate_separable_3d(array, *weights)
+
+    zoom_factors = np.array(target_shape.as_tuple()) / shape
+    result = np.empty((*array.shape[:-3], *target_shape.as_tuple()), dtype=np.uint8)
+
+    for block, zoomed in zip(array.reshape(-1, *shape), result.reshape(-1, *target_shape.as_tuple())):
+        zoomed[...] = zoom(block, zoom_factors, order=1)
+
+    return result
+
+
+def is_dyadic_zoom(size, target_size):
+    # coordinates i * (size - 1) / (target_size - 1) have a power of two in the denominator
+    if size == 1 or target_size == 1:
+        return True
+
+    denominator = (target_size - 1) // gcd(size - 1, target_size - 1)
+
+    return denominator & (denominator - 1) == 0
+
+
+@lru_cache(maxsize=None)
+def zoom_weights(size, target_size):
+    coordinates = np.arange(target_size) * ((size - 1) / (target_size - 1)) if target_size > 1 else np.zeros(1)
+
+    return linear_weights(coordinates, size)
 
-    return zoomed
+
+def linear_weights(coordinates, input_size):
+    # row i of the matrix interpolates input linearly at coordinates[i],
+    # coordinates outside of the input take the nearest edge sample like mode='nearest' of scipy.ndimage
+    lower = np.floor(coordinates).astype(int)
+    fractions = coordinates - lower
+    rows = np.arange(len(coordinates))
+
+    weights = np.zeros((len(coordinates), input_size))
+    np.add.at(weights, (rows, np.clip(lower, 0, input_size - 1)), 1 - fractions)
+    np.add.at(weights, (rows, np.clip(lower + 1, 0, input_size - 1)), fractions)
+
+    return weights
+
+
+def interpolate_separable_3d(array, rows_weights, cols_weights, frames_weights):
+    # linear interpolation along each of the last three axes, weights are dyadic fractions, so float results are exact
+    # and rounding half up gives the same samples as scipy.ndimage
+    result = array.astype(np.float64) @ frames_weights.T
+    result = (result.swapaxes(-1, -2) @ cols_weights.T).swapaxes(-1, -2)
+    result = np.moveaxis(np.moveaxis(result, -3, -1) @ rows_weights.T, -1, -3)
+
+    return np.floor(result + 0.5).astype(np.uint8)
 
 
 def averages_3d(array, chunk_shape: Shape3D, chunks_count: Shape3D):
     tmp_shape = np.column_stack([chunks_count.as_tuple(), chunk_shape.as_tuple()]).ravel()
 
-    cubes = array.reshape(tmp_shape).transpose(0, 2, 4, 1, 3, 5).reshape(-1, *chunk_shape.as_tuple())
-    averages = cubes.mean(axis=(1, 2, 3)).reshape(chunks_count.as_tuple()).astype(np.uint8)
+    batch = array.shape[:-3]
+    axes = [*range(len(batch)), *(len(batch) + np.array([0, 2, 4, 1, 3, 5]))]
+
+    cubes = array.reshape(*batch, *tmp_shape).transpose(axes).reshape(*batch, *chunks_count.as_tuple(), -1)
+    averages = cubes.mean(axis=-1).astype(np.uint8)
 
     return averages
+
+
+def chunk_sums(array, chunk: Shape3D, dtype):
+    # samples which do not fill a whole chunk at the end of an axis are skipped
+    rows, cols, frames = array.shape
+    chunks_count = Shape3D(rows // chunk.rows, cols // chunk.cols, frames // chunk.frames)
+
+    tmp_shape = np.column_stack([chunks_count.as_tuple(), chunk.as_tuple()]).ravel()
+    array = array[:chunks_count.rows * chunk.rows, :chunks_count.cols * chunk.cols, :chunks_count.frames * chunk.frames]
+
+    return array.reshape(tmp_shape).sum(axis=(1, 3, 5), dtype=dtype)
+
+
+def split_into_blocks(array, block: Shape3D):
+    rows, cols, frames = array.shape
+    blocks_count = Shape3D(rows // block.rows, cols // block.cols, frames // block.frames)
+
+    tmp_shape = np.column_stack([blocks_count.as_tuple(), block.as_tuple()]).ravel()
+
+    return array.reshape(tmp_shape).transpose(0, 2, 4, 1, 3, 5).reshape(-1, *block.as_tuple())
+
+
+def split_into_extended_blocks(array, block: Shape3D):
+    # blocks together with the row, column and frame preceding them, which overlap with neighbouring blocks,
+    # array has one such row, column and frame at the beginning
+    windows = np.lib.stride_tricks.sliding_window_view(array, (block + 1).as_tuple())
+
+    return windows[::block.rows, ::block.cols, ::block.frames].reshape(-1, *(block + 1).as_tuple())
+
+
+def merge_blocks(blocks, blocks_count: Shape3D):
+    # inverse of split_into_blocks
+    _, rows, cols, frames = blocks.shape
+
+    tmp_shape = (*blocks_count.as_tuple(), rows, cols, frames)
+    merged_shape = (blocks_count.rows * rows, blocks_count.cols * cols, blocks_count.frames * frames)
+
+    return blocks.reshape(tmp_shape).transpose(0, 3, 1, 4, 2, 5).reshape(merged_shape)
+
+
+def box_sums_2d(array, size):
+    # sums of square windows lying whole inside the first two axes
+    rows, cols = array.shape[:2]
+
+    rows_sums = array[:rows-size+1].copy()
+
+    for i in range(1, size):
+        rows_sums += array[i:rows-size+1+i]
+
+    sums = rows_sums[:, :cols-size+1].copy()
+
+    for i in range(1, size):
+        sums += rows_sums[:, i:cols-size+1+i]
+
+    return sums
+
+
+def window_sums_2d(array, kernel):
+    # weighted sums of windows lying whole inside the first two axes, kernel is applied along both of them,
+    # integer arrays and kernels give exact sums
+    size = len(kernel)
+    rows, cols = array.shape[:2]
+
+    rows_sums = sum(weight * array[i:rows-size+1+i] for i, weight in enumerate(kernel))
+
+    return sum(weight * rows_sums[:, i:cols-size+1+i] for i, weight in enumerate(kernel))
+
+
+def squared_errors_sum(source, decoded):
+    diff = (source.astype(np.int16) - decoded.astype(np.int16)).reshape(len(source), -1)
+
+    return np.einsum('ij,ij->i', diff, diff, dtype=np.int64)
+
+
+def squares_sum(array):
+    flat = array.reshape(len(array), -1)
+
+    return np.einsum('ij,ij->i', flat, flat, dtype=np.int64)
+
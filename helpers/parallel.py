@@ -0,0 +1,34 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from helpers.tracing import add_events, is_tracing, traced_call
+
+
+def ordered_map(function, items, workers):
+    if workers <= 1:
+        yield from map(function, items)
+        return
+
+    # results are yielded in order of items, at most two items per worker are waiting in memory at once
+    items = iter(items)
+
+    # spans recorded in worker processes come back together with results
+    tracing = is_tracing()
+
+    if tracing:
+        function = partial(traced_call, function)
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque(executor.submit(function, item) for item in islice(items, 2 * workers))
+
+        while pending:
+            result = pending.popleft().result()
+            pending.extend(executor.submit(function, item) for item in islice(items, 1))
+
+            if tracing:
+                result, events = result
+                add_events(events)
+
+            yield result
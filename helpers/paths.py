@@ -1,4 +1,5 @@
 import os.path
+from contextlib import contextmanager
 from os import path
 
 import numpy as np
@@ -7,6 +8,27 @@ SEQUENCES_DIR = path.normpath(path.join(__file__, '../../_sequences'))
 RESULTS_DIR = path.normpath(path.join(__file__, '../../_results'))
 
 SAMPLE_SEQUENCE_PATH = path.normpath(path.join(SEQUENCES_DIR, '144_176/akiyo.yuv'))
+JOBS_JOURNAL_PATH = path.join(RESULTS_DIR, 'jobs.log')
+FILE_HASHES_PATH = path.join(RESULTS_DIR, '_file_hashes.json')
+RESULTS_INDEX_NAME = 'results.sqlite'
+BENCH_DIR = path.join(RESULTS_DIR, '_bench')
+BENCH_BASELINE_PATH = path.join(BENCH_DIR, 'baseline.json')
+
+
+@contextmanager
+def atomic_write(file_path, mode='w'):
+    # file of this process is written first and then moved in place, so concurrent runs never see it half-written
+    os.makedirs(path.dirname(file_path), exist_ok=True)
+    temporary_path = f'{file_path}.{os.getpid()}.tmp'
+
+    try:
+        with open(temporary_path, mode) as file:
+            yield file
+
+        os.replace(temporary_path, file_path)
+    finally:
+        if path.exists(temporary_path):
+            os.remove(temporary_path)
 
 
 def modify_path(file_path, experiment_name, extension):
@@ -44,6 +66,25 @@ def stats_path(file_path, experiment_name=None):
     return modify_path(file_path, experiment_name, 'stats')
 
 
+def artifacts_path(file_path, experiment_name=None):
+    return modify_path(file_path, experiment_name, 'artifacts')
+
+
+def trace_path(file_path, experiment_name=None):
+    return modify_path(file_path, experiment_name, 'trace')
+
+
+def rd_hulls_cache_path(sequence_path, key):
+    sequence_name = path.splitext(path.basename(sequence_path))[0]
+
+    return path.join(RESULTS_DIR, path.basename(path.dirname(sequence_path)), '_rd_hulls', f'{sequence_name}__{key}.npz')
+
+
+def synthetic_sequence_path(rows, cols, seed):
+    # kept out of sequences directory, but in the same layout, so the shape is read from the directory name
+    return path.join(BENCH_DIR, f'{rows}_{cols}', f'synthetic_{seed}.yuv')
+
+
 def video_shape(file_path):
     shape_dir = path.dirname(file_path) if file_path.endswith('.yuv') else path.dirname(path.dirname(file_path))
     shape_data = path.basename(shape_dir).split('_')
@@ -0,0 +1,74 @@
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# on Linux peak RSS of the process can be reset, so it is measured for every stage on its own,
+# elsewhere it is the peak since the process started
+PROC_STATUS_PATH = '/proc/self/status'
+PROC_CLEAR_REFS_PATH = '/proc/self/clear_refs'
+
+
+class ResourceUsage:
+    # wall and CPU time of a stage, summed over every interval it is measured in, CPU time includes
+    # worker processes which finished in the meantime, peak RSS is the one of this process
+    def __init__(self, wall_time=0.0, user_time=0.0, system_time=0.0, peak_rss=None):
+        self.wall_time: float = wall_time
+        self.user_time: float = user_time
+        self.system_time: float = system_time
+        self.peak_rss: int = peak_rss
+
+    def __enter__(self):
+        reset_peak_rss()
+
+        self.start_times = os.times()
+        self.start_time = time.time()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        end_times = os.times()
+
+        self.wall_time += time.time() - self.start_time
+        self.user_time += end_times.user + end_times.children_user - self.start_times.user - self.start_times.children_user
+        self.system_time += end_times.system + end_times.children_system - self.start_times.system - self.start_times.children_system
+
+        peak_rss = current_peak_rss()
+
+        if peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, peak_rss)
+
+    def split(self, parts):
+        # share of one of configs encoded together, peak memory was taken by all of them at once
+        return ResourceUsage(self.wall_time / parts, self.user_time / parts, self.system_time / parts, self.peak_rss)
+
+    def as_dict(self):
+        return {'wall_time': self.wall_time, 'user_time': self.user_time, 'system_time': self.system_time, 'peak_rss': self.peak_rss}
+
+
+def reset_peak_rss():
+    try:
+        with open(PROC_CLEAR_REFS_PATH, 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def current_peak_rss():
+    # in bytes
+    if os.path.exists(PROC_STATUS_PATH):
+        with open(PROC_STATUS_PATH) as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return peak_rss if os.uname().sysname == 'Darwin' else peak_rss * 1024
+
+    return None
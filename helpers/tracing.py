@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# spans are recorded only while tracing is on, otherwise span() gives a shared context which does nothing
+# and traced functions are called directly, so the cost is a check of one global variable
+_tracer = None
+NO_SPAN = nullcontext()
+
+
+class Tracer:
+    def __init__(self):
+        # (name, start ns, duration ns, self duration ns, process, thread, args) of every finished span
+        self.events = []
+        self.local = threading.local()
+
+    def stack(self):
+        # spans are nested separately in every thread
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+
+class Span:
+    __slots__ = ['tracer', 'name', 'args', 'start', 'children_duration']
+
+    def __init__(self, tracer: Tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tracer.stack().append(self)
+        self.children_duration = 0
+        self.start = time.perf_counter_ns()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self.start
+
+        stack = self.tracer.stack()
+        stack.pop()
+
+        if stack:
+            stack[-1].children_duration += duration
+
+        self.tracer.events.append((self.name, self.start, duration, duration - self.children_duration, os.getpid(), threading.get_ident(), self.args))
+
+
+def span(name, **args):
+    return Span(_tracer, name, args) if _tracer is not None else NO_SPAN
+
+
+def traced(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+
+            with Span(_tracer, name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def is_tracing():
+    return _tracer is not None
+
+
+@contextmanager
+def tracing(enabled, trace_paths):
+    # trace of everything run inside is saved in Chrome trace format to every path, nested calls use the outer trace
+    global _tracer
+
+    if not enabled or _tracer is not None:
+        yield
+        return
+
+    _tracer = Tracer()
+
+    try:
+        with span('run'):
+            yield
+    finally:
+        events, _tracer = _tracer.events, None
+
+    for trace_path in trace_paths:
+        save_chrome_trace(events, trace_path)
+
+
+def traced_call(function, item):
+    # runs in a worker process, which may have a copy of the parent tracer, and sends its spans back with the result
+    global _tracer
+
+    _tracer = Tracer()
+
+    try:
+        result = function(item)
+    finally:
+        events, _tracer = _tracer.events, None
+
+    return result, events
+
+
+def add_events(events):
+    _tracer.events.extend(events)
+
+
+def trace_summary():
+    # totals of spans of the same name, self time does not include nested spans, so it shows where time goes,
+    # spans run once per part (or frame, block) give their mean and max next to the total
+    if _tracer is None:
+        return None
+
+    totals = {}
+
+    for name, _, duration, self_duration, *_ in list(_tracer.events):
+        count, total, self_total, max_duration = totals.get(name, (0, 0, 0, 0))
+        totals[name] = (count + 1, total + duration, self_total + self_duration, max(max_duration, duration))
+
+    summary = {}
+
+    for name, (count, total, self_total, max_duration) in sorted(totals.items(), key=lambda item: -item[1][2]):
+        summary[name] = {
+            'count': count,
+            'total [s]': round(total / 1e9, 4),
+            'self [s]': round(self_total / 1e9, 4),
+            'mean [ms]': round(total / count / 1e6, 4),
+            'max [ms]': round(max_duration / 1e6, 4)
+        }
+
+    return summary
+
+
+def save_chrome_trace(events, trace_path):
+    # complete events with times in microseconds, can be opened in chrome://tracing or Perfetto
+    trace_events = [
+        {'name': name, 'ph': 'X', 'ts': start / 1e3, 'dur': duration / 1e3, 'pid': pid, 'tid': tid, 'args': args}
+        for name, start, duration, _, pid, tid, args in events]
+
+    with open(trace_path, 'w') as file:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file)
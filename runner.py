@@ -1,43 +1,196 @@
 import os
-import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 
+import numpy as np
+
+from helpers.array_iterator import ArrayIterator
+from helpers.hashing import file_hash
 from helpers.paths import *
+from helpers.resources import ResourceUsage
+from helpers.tracing import span, tracing
 from codec.simple_decoder import SimpleDecoder
 from codec.interpolation_decoder import InterpolationDecoder
 from codec.simple_encoder import SimpleEncoder
 from codec.interpolation_encoder import InterpolationEncoder
+from codec.sweep_encoder import SweepEncoder
+from codec.artifacts import ArtifactsCache, Stage
 from codec.models import Config, EncodingType, DecodingType
-from stats.error_map import ErrorMap
-from stats.intensity_map import IntensityMap
+from stats.analysis import DecodingAnalysis, analyse_decoding
 from stats.stats import save_json_stats, export_stats_to_excel
 
 
-def run_codec(sequence_path, config):
+def run_codec(sequence_path, config, closed_loop=False, check_decoding=False):
     os.makedirs(experiment_dir_path(sequence_path, config.name), exist_ok=True)
 
-    start_time = time.time()
+    with tracing(config.trace, [trace_path(sequence_path, config.name)]):
+        # stages with outputs made from the same source, config and codec are not run again
+        artifacts = ArtifactsCache(sequence_path, config)
+
+        if artifacts.is_valid(Stage.ENCODE):
+            run_decoding(sequence_path, config, artifacts)
+            return
+
+        if closed_loop:
+            run_closed_loop(sequence_path, config, artifacts, check_decoding)
+            return
+
+        with span('encode'), ResourceUsage() as encoding_usage:
+            create_encoder(sequence_path, config).encode()
+
+        artifacts.save(Stage.ENCODE, encoding_usage)
+
+        run_decoding(sequence_path, config, artifacts)
+
+
+def run_closed_loop(sequence_path, config, artifacts: ArtifactsCache, check_decoding=False):
+    # every part is decoded in memory right after it is encoded and analysed together with source frames,
+    # so neither code nor decoded sequence is read back from disk, resources of each step are measured separately
+    encoding_usage, decoding_usage, analysis_usage = ResourceUsage(), ResourceUsage(), ResourceUsage()
+
+    with encoding_usage:
+        encoder = create_encoder(sequence_path, config)
+        parts = encoder.encode_parts()
+
+    with decoding_usage:
+        decoder = create_decoder(sequence_path, config, (encoder.source_rows, encoder.source_cols))
+
+    with analysis_usage:
+        analysis = DecodingAnalysis(sequence_path, config)
+
+    # decoder is closed even if encoding or analysis of a part fails, so its output file is not left open
+    try:
+        while True:
+            with encoding_usage:
+                encoded_part = next(parts, None)
+
+            if encoded_part is None:
+                break
+
+            code, metadata = encoded_part
+
+            with decoding_usage:
+                part = decoder.decode_part(ArrayIterator(code), ArrayIterator(np.frombuffer(metadata, dtype=np.uint8)))
+
+            with analysis_usage:
+                analysis.add_part(*part)
+    finally:
+        with decoding_usage:
+            decoder.close()
+
+    with analysis_usage:
+        metrics = analysis.finish()
+
+    # standalone decoder reads code from disk and has to give the same sequence
+    if check_decoding:
+        decoded_hash = file_hash(decoded_sequence_path(sequence_path, config.name))
+
+        create_decoder(sequence_path, config).decode()
+
+        if file_hash(decoded_sequence_path(sequence_path, config.name)) != decoded_hash:
+            raise RuntimeError(f'Decoder output differs from closed loop decoding of {config.name}')
+
+    save_json_stats(sequence_path, config, encoding_usage, decoding_usage, analysis_usage, metrics)
+
+    artifacts.save(Stage.ENCODE, encoding_usage)
+    artifacts.save(Stage.DECODE, decoding_usage)
+    artifacts.save(Stage.ANALYSE, analysis_usage)
+
+
+def run_sweep(sequence_path, configs):
+    # configs differ only in block shape, so one pass over the sequence encodes all of them,
+    # time of the pass is split equally between configs, the ones with valid code are left out
+    for config in configs:
+        os.makedirs(experiment_dir_path(sequence_path, config.name), exist_ok=True)
+
+    with tracing(any(config.trace for config in configs), [trace_path(sequence_path, config.name) for config in configs if config.trace]):
+        configs_artifacts = [ArtifactsCache(sequence_path, config) for config in configs]
+        encoded = [(config, artifacts) for config, artifacts in zip(configs, configs_artifacts) if not artifacts.is_valid(Stage.ENCODE)]
+
+        if encoded:
+            with span('encode'), ResourceUsage() as encoding_usage:
+                SweepEncoder(sequence_path, [config for config, _ in encoded]).encode()
+
+            for _, artifacts in encoded:
+                artifacts.save(Stage.ENCODE, encoding_usage.split(len(encoded)))
 
+        for config, artifacts in zip(configs, configs_artifacts):
+            run_decoding(sequence_path, config, artifacts)
+
+
+def run_decoding(sequence_path, config, artifacts: ArtifactsCache):
+    if not artifacts.is_valid(Stage.DECODE):
+        with span('decode'), ResourceUsage() as decoding_usage:
+            create_decoder(sequence_path, config).decode()
+
+        artifacts.save(Stage.DECODE, decoding_usage)
+
+    if not artifacts.is_valid(Stage.ANALYSE):
+        with span('analyse'), ResourceUsage() as analysis_usage:
+            metrics = analyse_decoding(sequence_path, config)
+
+        save_json_stats(sequence_path, config, artifacts.usage(Stage.ENCODE), artifacts.usage(Stage.DECODE), analysis_usage, metrics)
+
+        artifacts.save(Stage.ANALYSE, analysis_usage)
+
+
+def create_encoder(sequence_path, config):
     if config.encoding_type == EncodingType.PICK_INTERPOLATE:
-        InterpolationEncoder(sequence_path, config).encode()
-    else:
-        SimpleEncoder(sequence_path, config).encode()
+        return InterpolationEncoder(sequence_path, config)
 
-    mid_time = time.time()
+    return SimpleEncoder(sequence_path, config)
 
+
+def create_decoder(sequence_path, config, source_shape=None):
+    # shape of frames is needed only when parts are decoded without decode, which reads it from metadata
     if config.decoding_type == DecodingType.INTERPOLATE and config.encoding_type in [EncodingType.PICK_REPEAT, EncodingType.PICK_INTERPOLATE]:
-        InterpolationDecoder(code_path(sequence_path, config.name), config).decode()
+        return InterpolationDecoder(code_path(sequence_path, config.name), config, source_shape)
+
+    return SimpleDecoder(code_path(sequence_path, config.name), config, source_shape)
+
+
+def run_job(job):
+    # configs of one job which differ in block shape are encoded together with sweep, others (target BPPs of one
+    # sequence and mode) are run one after another, so all but the first take RD hulls from cache of the first
+    sequence_path, configs = job
+
+    if len({config.block for config in configs}) > 1:
+        run_sweep(sequence_path, configs)
     else:
-        SimpleDecoder(code_path(sequence_path, config.name), config).decode()
+        for config in configs:
+            run_codec(sequence_path, config, closed_loop=True)
 
-    end_time = time.time()
 
-    IntensityMap(metadata_path(sequence_path, config.name), config).create()
-    ErrorMap(sequence_path, decoded_sequence_path(sequence_path, config.name)).create()
+def is_job_done(job):
+    # analysis is the last stage, so its outputs are valid only when outputs of all stages are
+    sequence_path, configs = job
 
-    save_json_stats(sequence_path, config, mid_time - start_time, end_time - mid_time)
+    return all(ArtifactsCache(sequence_path, config).is_valid(Stage.ANALYSE) for config in configs)
 
 
-def run_bpps_batch():
+def run_jobs(jobs, workers=1):
+    # jobs run in separate processes, each finished or failed job is recorded in the journal and failure of one
+    # does not stop the others, jobs already done are skipped, so an interrupted batch continues where it stopped
+    pending = [job for job in jobs if not is_job_done(job)]
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+
+    with open(JOBS_JOURNAL_PATH, 'a') as journal, ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(run_job, job): job for job in pending}
+
+        for future in as_completed(futures):
+            sequence_path, configs = futures[future]
+            status = 'done' if future.exception() is None else f'failed: {future.exception()!r}'
+
+            for config in configs:
+                journal.write(f'{datetime.now().isoformat(timespec="seconds")}\t{os.path.relpath(sequence_path, SEQUENCES_DIR)}\t{config.name}\t{status}\n')
+
+            journal.flush()
+
+    return len(pending)
+
+
+def run_bpps_batch(workers=1):
     sequences_bpps = {
         # '144_176/akiyo.yuv': [1.0, 1.5, 2.0, 2.5],
 
@@ -63,16 +216,21 @@ def run_bpps_batch():
         [EncodingType.AVERAGE_INTERPOLATE, DecodingType.INTERPOLATE]
     ]
 
-    for sequence, target_bpps in sequences_bpps.items():
-        for target_bpp in target_bpps:
-            for mode in modes:
-                sequence_path = os.path.join(SEQUENCES_DIR, sequence)
-                run_codec(sequence_path, Config(16, 16, 16, target_bpp, mode[0], mode[1], ''))
+    # cores are split between jobs running at once
+    config_workers = max(1, os.cpu_count() // workers)
+
+    # one job for all target BPPs of a sequence and mode, so RD hulls are computed once even if jobs run at once
+    jobs = [
+        (os.path.join(SEQUENCES_DIR, sequence), [Config(16, 16, 16, target_bpp, mode[0], mode[1], '', workers=config_workers, rd_cache=True) for target_bpp in target_bpps])
+        for sequence, target_bpps in sequences_bpps.items()
+        for mode in modes]
+
+    run_jobs(jobs, workers)
 
     export_stats_to_excel(RESULTS_DIR)
 
 
-def run_blocks_batch():
+def run_blocks_batch(workers=1):
     sequences = [
         # '144_176/akiyo.yuv',
         
@@ -111,11 +269,21 @@ def run_blocks_batch():
         [EncodingType.AVERAGE_REPEAT, DecodingType.INTERPOLATE]
     ]
 
+    # cores are split between jobs running at once
+    config_workers = max(1, os.cpu_count() // workers)
+    jobs = []
+
     for sequence in sequences:
-        for rows, cols, frames in blocks:
-            for mode in modes:
-                sequence_path = os.path.join(SEQUENCES_DIR, sequence)
-                run_codec(sequence_path, Config(rows, cols, frames, 1.0, mode[0], mode[1], ''))
+        for mode in modes:
+            sequence_path = os.path.join(SEQUENCES_DIR, sequence)
+            configs = [Config(rows, cols, frames, 1.0, mode[0], mode[1], '', workers=config_workers) for rows, cols, frames in blocks]
+
+            if mode[0] == EncodingType.AVERAGE_REPEAT:
+                jobs.append((sequence_path, configs))
+            else:
+                jobs.extend((sequence_path, [config]) for config in configs)
+
+    run_jobs(jobs, workers)
 
     export_stats_to_excel(RESULTS_DIR)
 
@@ -0,0 +1,72 @@
+from helpers.numpy_extensions import repeat_3d
+from helpers.parallel import ordered_map
+from helpers.paths import decoded_sequence_path, metadata_path, video_shape
+from helpers.tracing import traced
+from codec.models import Config, Shape3D
+from stats.error_map import ErrorMap
+from stats.intensity_map import IntensityMap
+from stats.metrics import BATCH_FRAMES, SequenceMetrics, frames_batches, planes_metrics, read_batch_planes
+from yuv_io.yuv_reader import YuvReader
+
+
+@traced('analyse batch')
+def analyse_batch(batch):
+    original_planes, decoded_planes = read_batch_planes(batch)
+
+    return *planes_metrics(original_planes, decoded_planes), ErrorMap.error_frames(original_planes, decoded_planes)
+
+
+def analyse_decoding(sequence_path, config: Config):
+    # original and decoded frames are read once, every batch of them gives both metrics and error map,
+    # batches can be analysed in separate processes and are consumed in order, intensity map needs only metadata
+    decoded_path = decoded_sequence_path(sequence_path, config.name)
+
+    metrics = SequenceMetrics(video_shape(sequence_path))
+    error_map = ErrorMap(sequence_path, decoded_path)
+
+    for squared_errors, ssims, error_frames in ordered_map(analyse_batch, frames_batches(sequence_path, decoded_path), config.workers):
+        metrics.add(squared_errors, ssims)
+        error_map.write_frames(error_frames)
+
+    error_map.close()
+
+    IntensityMap(metadata_path(sequence_path, config.name), config).create()
+
+    return metrics
+
+
+class DecodingAnalysis:
+    # analysis of parts passed in order right after they are decoded, source frames are read along with them
+    def __init__(self, sequence_path, config: Config):
+        self.sequence_path = sequence_path
+        self.config = config
+
+        self.source_reader = YuvReader(sequence_path)
+        self.frames = 0
+
+        self.metrics = SequenceMetrics(video_shape(sequence_path))
+        self.error_map = ErrorMap(sequence_path, decoded_sequence_path(sequence_path, config.name))
+
+    @traced('analyse part')
+    def add_part(self, y_part, u_part, v_part):
+        # planes of the part as they are written into decoded sequence, chroma is brought to full size like in YuvReader
+        u_part = repeat_3d(u_part, Shape3D(2, 2, 1))
+        v_part = repeat_3d(v_part, Shape3D(2, 2, 1))
+
+        for start in range(0, y_part.shape[2], BATCH_FRAMES):
+            decoded_planes = [plane[:, :, start:start+BATCH_FRAMES] for plane in [y_part, u_part, v_part]]
+            frames = decoded_planes[0].shape[2]
+
+            original_planes = self.source_reader.read_planes_batch(self.frames, self.frames + frames, upsample_uv=True)
+            self.frames += frames
+
+            self.metrics.add(*planes_metrics(original_planes, decoded_planes))
+            self.error_map.write_frames(ErrorMap.error_frames(original_planes, decoded_planes))
+
+    def finish(self):
+        # metadata has to be written whole before intensity map is created
+        self.error_map.close()
+
+        IntensityMap(metadata_path(self.sequence_path, self.config.name), self.config).create()
+
+        return self.metrics
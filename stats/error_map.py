@@ -1,28 +1,35 @@
 import numpy as np
 
 from helpers.paths import error_map_path
+from helpers.tracing import traced
+from stats.metrics import frames_batches, read_batch_planes
 from yuv_io.maps_writer import MapsWriter
-from yuv_io.yuv_reader import YuvReader
 
 
 class ErrorMap:
     def __init__(self, sequence_path, decoded_sequence_path):
-        self.sequence_reader = YuvReader(sequence_path)
-        self.decoded_reader = YuvReader(decoded_sequence_path)
+        self.sequence_path = sequence_path
+        self.decoded_sequence_path = decoded_sequence_path
         self.writer = MapsWriter(error_map_path(decoded_sequence_path))
 
     def create(self):
-        while True:
-            frame = self.sequence_reader.read_next()
-            decoded = self.decoded_reader.read_next()
+        for batch in frames_batches(self.sequence_path, self.decoded_sequence_path):
+            self.write_frames(self.error_frames(*read_batch_planes(batch)))
 
-            if frame is None or decoded is None:
-                break
+        self.close()
 
-            diff = np.abs(frame.astype(int) - decoded.astype(int))
-            diff = np.sum(diff, axis=2) * 10
-            diff = np.clip(diff, 0, 255).astype(np.uint8)
-
-            self.writer.write_next(diff)
+    def write_frames(self, frames):
+        for i in range(frames.shape[2]):
+            self.writer.write_next(frames[:, :, i])
 
+    def close(self):
         self.writer.close()
+
+    @staticmethod
+    @traced('error map')
+    def error_frames(original_planes, decoded_planes):
+        # absolute errors of full size planes summed together
+        diff = sum(np.abs(original.astype(np.int16) - decoded.astype(np.int16)) for original, decoded in zip(original_planes, decoded_planes))
+        diff = diff * 10
+
+        return np.clip(diff, 0, 255).astype(np.uint8)
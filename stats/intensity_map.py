@@ -2,6 +2,7 @@ import numpy as np
 
 from helpers.array_iterator import ArrayIterator
 from helpers.paths import intensity_map_path
+from helpers.tracing import traced
 from codec.models import Config, Shape3D
 from yuv_io.maps_writer import MapsWriter
 
@@ -18,6 +19,7 @@ class IntensityMap:
 
         self.writer = MapsWriter(intensity_map_path(metadata_path))
 
+    @traced('intensity map')
     def create(self):
         while self.metadata.has_next():
             y_part = np.zeros((self.source_rows, self.source_cols, self.block.frames), dtype=np.uint8)
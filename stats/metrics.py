@@ -0,0 +1,155 @@
+from functools import partial
+
+import numpy as np
+
+from helpers.numpy_extensions import box_sums_2d, window_sums_2d
+from helpers.parallel import ordered_map
+from helpers.paths import video_shape
+from helpers.tracing import traced
+from yuv_io.yuv_reader import YuvReader
+
+
+PLANES = ['Y', 'U', 'V']
+
+MAX_VALUE = 255
+BATCH_FRAMES = 4
+
+# constants of SSIM, the same as defaults of skimage.metrics.structural_similarity
+SSIM_WINDOW = 7
+SSIM_SIGMA = 1.5
+SSIM_TRUNCATE = 3.5
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+
+class SequenceMetrics:
+    # squared errors sums and SSIM of every plane of every frame, filled batch by batch,
+    # metrics of frames are averaged in the end, chroma planes are compared in full size
+    def __init__(self, frame_shape):
+        self.samples_count = frame_shape[0] * frame_shape[1]
+
+        self.squared_errors = []
+        self.ssims = []
+
+    def add(self, squared_errors, ssims):
+        self.squared_errors.append(squared_errors)
+        self.ssims.append(ssims)
+
+    def frames_mse(self, plane_idx=None):
+        squared_errors = np.hstack(self.squared_errors)
+
+        if plane_idx is None:
+            return squared_errors.sum(axis=0) / (len(PLANES) * self.samples_count)
+
+        return squared_errors[plane_idx] / self.samples_count
+
+    def frames_ssim(self, plane_idx=None):
+        ssims = np.hstack(self.ssims)
+
+        return ssims.mean(axis=0) if plane_idx is None else ssims[plane_idx]
+
+    def mse(self, plane_idx=None):
+        return self.frames_mse(plane_idx).mean()
+
+    def psnr(self, plane_idx=None):
+        # frames without errors have infinite PSNR, like in skimage
+        with np.errstate(divide='ignore'):
+            return (10 * np.log10(MAX_VALUE ** 2 / self.frames_mse(plane_idx))).mean()
+
+    def ssim(self, plane_idx=None):
+        return self.frames_ssim(plane_idx).mean()
+
+
+@traced('metrics')
+def planes_metrics(original_planes, decoded_planes, gaussian_weights=False):
+    # planes of a batch of frames, each of shape (rows, cols, frames)
+    squared_errors = np.empty((len(PLANES), original_planes[0].shape[2]), dtype=np.int64)
+    ssims = np.empty((len(PLANES), original_planes[0].shape[2]))
+
+    for idx, (original, decoded) in enumerate(zip(original_planes, decoded_planes)):
+        diff = original.astype(np.int32) - decoded.astype(np.int32)
+
+        squared_errors[idx] = np.einsum('ijk,ijk->k', diff, diff, dtype=np.int64)
+        ssims[idx] = frames_ssim(original, decoded, gaussian_weights)
+
+    return squared_errors, ssims
+
+
+def frames_ssim(original, decoded, gaussian_weights=False):
+    # SSIM of every frame of planes of shape (rows, cols, frames), computed from statistics of windows
+    # lying whole inside the frame, which are the only ones skimage takes into the mean
+    kernel = ssim_kernel(gaussian_weights)
+    weights_sum = kernel.sum() ** 2
+
+    # sample covariance is used with uniform window only, like in skimage
+    covariance_norm = 1 if gaussian_weights else weights_sum / (weights_sum - 1)
+
+    # window sums of squared samples fit into 32 bits
+    x = original.astype(np.int32)
+    y = decoded.astype(np.int32)
+
+    if gaussian_weights:
+        sx, sy, sxx, syy, sxy = [window_sums_2d(array, kernel) for array in [x, y, x * x, y * y, x * y]]
+    else:
+        sx, sy, sxx, syy, sxy = [box_sums_2d(array, len(kernel)) for array in [x, y, x * x, y * y, x * y]]
+
+    # numerator and denominator are multiplied by squared sum of weights, so means are never divided out
+    # and with uniform window everything except constants stays in integers
+    c1 = (SSIM_K1 * MAX_VALUE * weights_sum) ** 2
+    c2 = (SSIM_K2 * MAX_VALUE * weights_sum) ** 2
+
+    sx_sy = sx * sy
+    sx_sx_sy_sy = sx * sx
+    sx_sx_sy_sy += sy * sy
+
+    covariance = weights_sum * sxy
+    covariance -= sx_sy
+    numerator = 2 * sx_sy + c1
+    numerator *= 2 * covariance_norm * covariance + c2
+
+    variances = weights_sum * (sxx + syy)
+    variances -= sx_sx_sy_sy
+    denominator = sx_sx_sy_sy + c1
+    denominator *= covariance_norm * variances + c2
+
+    return (numerator / denominator).mean(axis=(0, 1))
+
+
+def ssim_kernel(gaussian_weights):
+    if not gaussian_weights:
+        return np.ones(SSIM_WINDOW, dtype=np.int32)
+
+    radius = int(SSIM_TRUNCATE * SSIM_SIGMA + 0.5)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / SSIM_SIGMA) ** 2)
+
+    return kernel / kernel.sum()
+
+
+def frames_batches(sequence_path, decoded_path):
+    # ranges of frames, which are read from memory mapped files, so every process reads only its own frames
+    frames = YuvReader(decoded_path).frames_count
+
+    return [(sequence_path, decoded_path, start, min(start + BATCH_FRAMES, frames)) for start in range(0, frames, BATCH_FRAMES)]
+
+
+def read_batch_planes(batch):
+    sequence_path, decoded_path, start, end = batch
+
+    original_planes = YuvReader(sequence_path).read_planes_batch(start, end, upsample_uv=True)
+    decoded_planes = YuvReader(decoded_path).read_planes_batch(start, end, upsample_uv=True)
+
+    return original_planes, decoded_planes
+
+
+def batch_metrics(batch, gaussian_weights=False):
+    return planes_metrics(*read_batch_planes(batch), gaussian_weights)
+
+
+def calculate_sequence_metrics(sequence_path, decoded_path, workers=1, gaussian_weights=False):
+    metrics = SequenceMetrics(video_shape(sequence_path))
+    batches = frames_batches(sequence_path, decoded_path)
+
+    for result in ordered_map(partial(batch_metrics, gaussian_weights=gaussian_weights), batches, workers):
+        metrics.add(*result)
+
+    return metrics
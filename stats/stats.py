@@ -1,15 +1,18 @@
 import glob
 import json
 import os
+import sqlite3
+from contextlib import closing
 from datetime import datetime
 
 import pandas as pd
 from janitor import xlsx_table
-from skimage.metrics import mean_squared_error, peak_signal_noise_ratio, structural_similarity
 
 from helpers.paths import *
+from helpers.resources import ResourceUsage
+from helpers.tracing import trace_summary
 from codec.models import Config
-from yuv_io.yuv_reader import YuvReader
+from stats.metrics import PLANES, calculate_sequence_metrics
 
 
 EXCEL_SHEET_NAME = 'CodecStats'
@@ -19,6 +22,8 @@ PROP_SEQUENCE_PATH = 'Sequence path'
 PROP_EXPERIMENT_NAME = 'Experiment name'
 PROP_ENCODING_MODE = 'Encoding mode'
 PROP_DECODING_MODE = 'Decoding mode'
+PROP_ALLOCATION_MODE = 'Allocation mode'
+PROP_CHROMA_MODE = 'Chroma mode'
 PROP_BLOCK_SIZE = 'Block shape'
 PROP_TARGET_BPP = 'Target BPP'
 PROP_BITS_PER_PIXEL = 'BPP'
@@ -27,6 +32,9 @@ PROP_COMPRESSION_RATE_INCLUDING_META = 'CR (including meta)'
 PROP_MSE = 'MSE'
 PROP_PSNR = 'PSNR [dB]'
 PROP_SSIM = 'SSIM'
+PROP_PLANE_MSE = 'MSE {}'
+PROP_PLANE_PSNR = 'PSNR {} [dB]'
+PROP_PLANE_SSIM = 'SSIM {}'
 PROP_RESOLUTION = 'Resolution'
 PROP_FRAMES_COUNT = 'Frames count'
 PROP_SEQUENCE_SIZE = 'Sequence size [bytes]'
@@ -34,6 +42,21 @@ PROP_CODE_SIZE = 'Code size [bytes]'
 PROP_METADATA_SIZE = 'Metadata size [bytes]'
 PROP_ENCODING_TIME = 'Encoding time [s]'
 PROP_DECODING_TIME = 'Decoding time [s]'
+PROP_ANALYSIS_TIME = 'Analysis time [s]'
+PROP_STAGE_USER_TIME = '{} user CPU time [s]'
+PROP_STAGE_SYSTEM_TIME = '{} system CPU time [s]'
+PROP_STAGE_PEAK_RSS = '{} peak RSS [MB]'
+PROP_STAGE_FPS = '{} FPS'
+PROP_TRACE = 'Trace'
+
+# columns of the results index which queries filter by, the whole stats are kept next to them as JSON
+INDEX_COLUMNS = {
+    'sequence': PROP_SEQUENCE_PATH,
+    'encoding_mode': PROP_ENCODING_MODE,
+    'decoding_mode': PROP_DECODING_MODE,
+    'block_shape': PROP_BLOCK_SIZE,
+    'target_bpp': PROP_TARGET_BPP
+}
 
 
 def create_excel(df, stats_file_path):
@@ -60,73 +83,159 @@ def add_table_to_excel(writer, dataframe):
     worksheet.freeze_panes(0, 2)
 
 
-def calculate_metrics(sequence_path, experiment_name):
-    sequence_reader = YuvReader(sequence_path)
-    decoded_sequence_reader = YuvReader(decoded_sequence_path(sequence_path, experiment_name))
+def calculate_metrics(sequence_path, experiment_name, workers=1):
+    return calculate_sequence_metrics(sequence_path, decoded_sequence_path(sequence_path, experiment_name), workers)
 
-    frames_number = frames_count(decoded_sequence_path(sequence_path, experiment_name))
 
-    mse_for_frames = np.zeros(frames_number)
-    ssim_for_frames = np.zeros(frames_number)
-    psnr_for_frames = np.zeros(frames_number)
-
-    for i in range(frames_number):
-        original_frame = sequence_reader.read_next()
-        decoded_frame = decoded_sequence_reader.read_next()
-
-        mse_for_frames[i] = mean_squared_error(original_frame, decoded_frame)
-        psnr_for_frames[i] = peak_signal_noise_ratio(original_frame, decoded_frame)
-        ssim_for_frames[i] = structural_similarity(original_frame, decoded_frame, channel_axis=2)
-
-    mse = mse_for_frames.mean()
-    psnr = psnr_for_frames.mean()
-    ssim = ssim_for_frames.mean()
-
-    return mse, psnr, ssim
-
-
-def save_json_stats(sequence_path, config: Config, coding_time, decoding_time):
+def save_json_stats(sequence_path, config: Config, encoding_usage: ResourceUsage, decoding_usage: ResourceUsage,
+                    analysis_usage: ResourceUsage = None, metrics=None):
     sequence_size = 2 * os.path.getsize(sequence_path)
     code_size = os.path.getsize(code_path(sequence_path, config.name))
     metadata_size = os.path.getsize(metadata_path(sequence_path, config.name))
     resolution = video_shape(sequence_path)
+    frames = frames_count(sequence_path)
 
-    mse, psnr, ssim = calculate_metrics(sequence_path, config.name)
+    if metrics is None:
+        metrics = calculate_metrics(sequence_path, config.name, config.workers)
 
     stats = {
         PROP_SEQUENCE_PATH: os.path.relpath(sequence_path, SEQUENCES_DIR),
         PROP_EXPERIMENT_NAME: config.name,
         PROP_ENCODING_MODE: config.encoding_type.name.lower(),
         PROP_DECODING_MODE: config.decoding_type.name.lower(),
+        PROP_ALLOCATION_MODE: config.allocation_type.name.lower(),
+        PROP_CHROMA_MODE: config.chroma_type.name.lower(),
         PROP_BLOCK_SIZE: f'[{config.block.rows}, {config.block.cols}, {config.block.frames}]',
         PROP_TARGET_BPP: config.target_bpp,
         PROP_BITS_PER_PIXEL: code_size / sequence_size * 24,
         PROP_BITS_PER_PIXEL_INCLUDING_META: (code_size + metadata_size) / sequence_size * 24,
         PROP_COMPRESSION_RATE_INCLUDING_META: sequence_size / (code_size + metadata_size),
-        PROP_MSE: mse,
-        PROP_PSNR: psnr,
-        PROP_SSIM: ssim,
+        PROP_MSE: metrics.mse(),
+        PROP_PSNR: metrics.psnr(),
+        PROP_SSIM: metrics.ssim(),
         PROP_RESOLUTION: f'{resolution[0]}x{resolution[1]}',
-        PROP_FRAMES_COUNT: frames_count(sequence_path),
+        PROP_FRAMES_COUNT: frames,
         PROP_SEQUENCE_SIZE: sequence_size,
         PROP_CODE_SIZE: code_size,
         PROP_METADATA_SIZE: metadata_size,
-        PROP_ENCODING_TIME: round(coding_time, 2),
-        PROP_DECODING_TIME: round(decoding_time, 2)
+        PROP_ENCODING_TIME: round(encoding_usage.wall_time, 2),
+        PROP_DECODING_TIME: round(decoding_usage.wall_time, 2)
     }
 
-    json.dump(stats, open(stats_path(sequence_path, config.name), 'w'), indent=4)
+    if analysis_usage is not None:
+        stats[PROP_ANALYSIS_TIME] = round(analysis_usage.wall_time, 2)
+
+    stages = [('Encoding', encoding_usage), ('Decoding', decoding_usage), ('Analysis', analysis_usage)]
+
+    for stage, usage in stages:
+        if usage is None:
+            continue
+
+        stats[PROP_STAGE_USER_TIME.format(stage)] = round(usage.user_time, 2)
+        stats[PROP_STAGE_SYSTEM_TIME.format(stage)] = round(usage.system_time, 2)
+        stats[PROP_STAGE_PEAK_RSS.format(stage)] = round(usage.peak_rss / 2**20, 1) if usage.peak_rss is not None else None
+
+    # throughput of the codec, analysis is not a part of it
+    for stage, usage in stages[:2]:
+        stats[PROP_STAGE_FPS.format(stage)] = round(frames / usage.wall_time, 2) if usage.wall_time > 0 else None
+
+    for plane_idx, plane in enumerate(PLANES):
+        stats[PROP_PLANE_MSE.format(plane)] = metrics.mse(plane_idx)
+        stats[PROP_PLANE_PSNR.format(plane)] = metrics.psnr(plane_idx)
+        stats[PROP_PLANE_SSIM.format(plane)] = metrics.ssim(plane_idx)
+
+    # time spent in traced functions, only when the experiment is traced, a sweep is traced whole
+    # when any of its configs is, so the summary is left out of the ones which are not
+    trace = trace_summary() if config.trace else None
+
+    if trace is not None:
+        stats[PROP_TRACE] = trace
+
+    stats_file_path = stats_path(sequence_path, config.name)
+
+    with open(stats_file_path, 'w') as file:
+        json.dump(stats, file, indent=4)
+
+    with closing(open_results_index(RESULTS_DIR)) as connection, connection:
+        index_stats(connection, RESULTS_DIR, stats_file_path, stats)
+
+
+def open_results_index(results_dir):
+    # every experiment writes its stats into the index as soon as it finishes, jobs run in parallel processes,
+    # so writers wait for each other and readers are not blocked by them
+    connection = sqlite3.connect(os.path.join(results_dir, RESULTS_INDEX_NAME), timeout=60)
+    connection.execute('PRAGMA journal_mode=WAL')
+
+    connection.execute(
+        f'CREATE TABLE IF NOT EXISTS results (stats_path TEXT PRIMARY KEY, modified INTEGER, '
+        f'{", ".join(INDEX_COLUMNS)}, stats TEXT)')
+
+    for column in INDEX_COLUMNS:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS results_{column} ON results ({column})')
+
+    return connection
+
+
+def index_stats(connection, results_dir, stats_file_path, stats):
+    # stats file is the key, so running an experiment again replaces its row
+    values = [os.path.relpath(stats_file_path, results_dir), os.stat(stats_file_path).st_mtime_ns]
+    values += [stats[prop] for prop in INDEX_COLUMNS.values()]
+    values += [json.dumps(stats)]
+
+    connection.execute(f'INSERT OR REPLACE INTO results VALUES ({", ".join("?" * len(values))})', values)
+
+
+def sync_results_index(results_dir):
+    # only stats files which are new or changed since they were indexed are read, rows of removed ones are dropped
+    with closing(open_results_index(results_dir)) as connection, connection:
+        indexed = dict(connection.execute('SELECT stats_path, modified FROM results'))
+        found = set()
+
+        for path_, _, files in os.walk(results_dir):
+            for file in files:
+                if not file.endswith('.stats'):
+                    continue
+
+                stats_file_path = os.path.join(path_, file)
+                key = os.path.relpath(stats_file_path, results_dir)
+                found.add(key)
+
+                if indexed.get(key) != os.stat(stats_file_path).st_mtime_ns:
+                    index_stats(connection, results_dir, stats_file_path, json.load(open(stats_file_path)))
+
+        connection.executemany('DELETE FROM results WHERE stats_path = ?', [(key,) for key in indexed.keys() - found])
+
+
+def query_stats(results_dir=RESULTS_DIR, **filters):
+    # filters are index columns with a value or a list of values, e.g. encoding_mode='average_repeat', target_bpp=[0.5, 1.0],
+    # index is brought up to date with stats files first, which reads only the ones changed since they were indexed
+    sync_results_index(results_dir)
+
+    conditions = []
+    values = []
+
+    for column, value in filters.items():
+        if column not in INDEX_COLUMNS:
+            raise ValueError(f'Results index has no column {column}')
+
+        value = value if isinstance(value, (list, tuple)) else [value]
+        conditions.append(f'{column} IN ({", ".join("?" * len(value))})')
+        values.extend(value)
+
+    query = 'SELECT stats FROM results'
 
+    if conditions:
+        query += f' WHERE {" AND ".join(conditions)}'
 
-def export_stats_to_excel(results_dir):
-    stats_paths = []
+    with closing(open_results_index(results_dir)) as connection:
+        rows = connection.execute(f'{query} ORDER BY stats_path', values).fetchall()
 
-    for path_, _, files in os.walk(results_dir):
-        stats_paths.extend([os.path.join(path_, file) for file in files if file.endswith('.stats')])
+    return pd.DataFrame([json.loads(stats) for stats, in rows])
 
-    stats_list = [json.load(open(file_path)) for file_path in stats_paths]
 
-    df = pd.DataFrame(stats_list)
+def export_stats_to_excel(results_dir, **filters):
+    # Excel is a view of the results index, trace summary is a nested table, which does not fit into a cell
+    df = query_stats(results_dir, **filters).drop(columns=[PROP_TRACE], errors='ignore')
     stats_file_path = os.path.join(RESULTS_DIR, f'stats_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
 
     create_excel(df, stats_file_path)
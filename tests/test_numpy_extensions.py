@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+import pytest
+from scipy.ndimage import zoom
+
+from helpers.numpy_extensions import zoom_3d
+from codec.models import Config, EncodingType, DecodingType, Shape3D
+
+# sizes of samples along one axis and sizes they are zoomed to, with odd ones and ones of edge blocks
+SAMPLES_SIZES = [1, 2, 3, 4, 5, 7]
+TARGET_SIZES = [1, 2, 3, 5, 8, 9, 13, 17, 25, 33]
+
+
+def scipy_zoom_3d(array, target_shape: Shape3D):
+    zoom_factors = np.array(target_shape.as_tuple()) / array.shape[-3:]
+
+    return np.array([zoom(block, zoom_factors, order=1) for block in array.reshape(-1, *array.shape[-3:])]).reshape(
+        *array.shape[:-3], *target_shape.as_tuple())
+
+
+@pytest.mark.parametrize('rows, cols, frames', list(itertools.product(SAMPLES_SIZES, repeat=3)))
+def test_zoom_3d_equals_scipy(rows, cols, frames):
+    rng = np.random.default_rng(rows * 100 + cols * 10 + frames)
+    blocks = rng.integers(0, 256, (4, rows, cols, frames), dtype=np.uint8)
+
+    for target in rng.choice(TARGET_SIZES, (8, 3)):
+        target_shape = Shape3D(*target)
+
+        assert np.array_equal(zoom_3d(blocks, target_shape), scipy_zoom_3d(blocks, target_shape)), target
+
+
+@pytest.mark.parametrize('samples, target', [((3, 3, 2), (9, 25, 3)), ((2, 2, 2), (25, 25, 3)), ((5, 2, 3), (17, 25, 5))])
+def test_zoom_3d_equals_scipy_at_ties(samples, target):
+    # non-dyadic ratios where samples halfway between two values are rounded by scipy in its own way
+    blocks = np.random.default_rng(0).integers(0, 256, (64, *samples), dtype=np.uint8)
+
+    assert np.array_equal(zoom_3d(blocks, Shape3D(*target)), scipy_zoom_3d(blocks, Shape3D(*target)))
+
+
+@pytest.mark.parametrize('block, edge', [((32, 32, 2), (32, 24, 2)), ((64, 64, 1), (8, 24, 1)), ((16, 16, 4), (16, 7, 4))])
+def test_zoom_3d_equals_scipy_for_modes_of_edge_blocks(block, edge):
+    config = Config(*block, 1.0, EncodingType.PICK_INTERPOLATE, DecodingType.INTERPOLATE, '')
+    rng = np.random.default_rng(0)
+
+    for mode in config.get_modes(Shape3D(*edge)):
+        # samples picked from a block extended by one row, column and frame, as in the decoder
+        samples_shape = [len(range(0, size + 1, chunk)) for size, chunk in zip(mode.block.as_tuple(), mode.y_chunk.as_tuple())]
+        samples = rng.integers(0, 256, (4, *samples_shape), dtype=np.uint8)
+
+        assert np.array_equal(zoom_3d(samples, mode.block + 1), scipy_zoom_3d(samples, mode.block + 1))
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from codec.rd import convex_hulls, bisection, greedy_slope
+
+
+def random_hulls(blocks, distortion_scale, seed=0):
+    # RD points of every mode of every block with distortion falling as rate grows, mode ids are positions
+    rng = np.random.default_rng(seed)
+    rates = np.array([0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0])
+
+    rds = np.empty((blocks, len(rates), 3))
+    rds[:, :, 0] = np.arange(len(rates))
+    rds[:, :, 1] = rates
+    rds[:, :, 2] = distortion_scale / (rates + 0.1) * rng.uniform(0.5, 1.5, (blocks, len(rates)))
+
+    return convex_hulls(rds)
+
+
+def mean_rate(rd_hulls, mode_ids):
+    return np.mean([rd_hull[rd_hull[:, 0] == mode_id][0, 1] for rd_hull, mode_id in zip(rd_hulls, mode_ids)])
+
+
+@pytest.mark.parametrize('allocation_function', [bisection, greedy_slope])
+def test_target_below_lowest_rates_gives_lowest_rates(allocation_function):
+    rd_hulls = random_hulls(50, 2000)
+    mode_ids = allocation_function(rd_hulls, 0.01)
+
+    assert mode_ids == [int(rd_hull[np.argmin(rd_hull[:, 1]), 0]) for rd_hull in rd_hulls]
+
+
+@pytest.mark.parametrize('allocation_function', [bisection, greedy_slope])
+def test_target_is_met_for_large_distortions(allocation_function):
+    # distortions of large blocks need slopes far above the initial range of lambda
+    rd_hulls = random_hulls(50, 1e9)
+    mode_ids = allocation_function(rd_hulls, 0.5)
+
+    assert len(mode_ids) == len(rd_hulls)
+    assert 0.25 <= mean_rate(rd_hulls, mode_ids) <= 0.5
@@ -0,0 +1,30 @@
+import json
+import os
+import shutil
+
+from stats.stats import INDEX_COLUMNS, PROP_TARGET_BPP, query_stats
+
+
+def write_stats(results_dir, experiment, target_bpp):
+    stats = {prop: experiment for prop in INDEX_COLUMNS.values()}
+    stats[PROP_TARGET_BPP] = target_bpp
+
+    os.makedirs(os.path.join(results_dir, experiment), exist_ok=True)
+
+    with open(os.path.join(results_dir, experiment, 's.stats'), 'w') as file:
+        json.dump(stats, file)
+
+
+def test_query_stats_follows_stats_files(tmp_path):
+    results_dir = str(tmp_path)
+    write_stats(results_dir, 'a', 1.0)
+    write_stats(results_dir, 'b', 1.0)
+
+    assert len(query_stats(results_dir)) == 2
+
+    # stats files removed or rewritten outside of save_json_stats
+    shutil.rmtree(os.path.join(results_dir, 'a'))
+    write_stats(results_dir, 'b', 2.0)
+    os.utime(os.path.join(results_dir, 'b', 's.stats'), ns=(0, 0))
+
+    assert query_stats(results_dir)[PROP_TARGET_BPP].tolist() == [2.0]
@@ -8,7 +8,7 @@ from PyQt6.QtWidgets import *
 
 from helpers.paths import SEQUENCES_DIR, SAMPLE_SEQUENCE_PATH, decoded_sequence_path, intensity_map_path, \
     RESULTS_DIR, stats_path, error_map_path
-from codec.models import EncodingType, Config, DecodingType
+from codec.models import EncodingType, Config, DecodingType, AllocationType, ChromaType
 from runner import run_codec, export_stats_to_excel
 from yuv_io.yuv_player import YuvPlayer
 
@@ -115,6 +115,28 @@ class App(QMainWindow):
         layout.addWidget(self.decoding_box, row, 1)
         row += 1
 
+        tmp = QLabel('Allocation mode')
+        layout.addWidget(tmp, row, 0)
+
+        self.allocation_box = QComboBox(self)
+        for item in AllocationType:
+            self.allocation_box.addItem(item.name.lower(), item)
+        self.allocation_box.setCurrentIndex(0)
+        self.allocation_box.currentTextChanged.connect(self.update_config_and_buttons_availability)
+        layout.addWidget(self.allocation_box, row, 1)
+        row += 1
+
+        tmp = QLabel('Chroma mode')
+        layout.addWidget(tmp, row, 0)
+
+        self.chroma_box = QComboBox(self)
+        for item in ChromaType:
+            self.chroma_box.addItem(item.name.lower(), item)
+        self.chroma_box.setCurrentIndex(0)
+        self.chroma_box.currentTextChanged.connect(self.update_config_and_buttons_availability)
+        layout.addWidget(self.chroma_box, row, 1)
+        row += 1
+
         tmp = QLabel('Additional info')
         layout.addWidget(tmp, row, 0)
 
@@ -244,9 +266,11 @@ class App(QMainWindow):
         target_bpp = None if self.target_bpp_box.text() in ['', ',', '.'] else float(self.target_bpp_box.text().replace(',', '.'))
         encoding = self.encoding_box.currentData()
         decoding = self.decoding_box.currentData()
+        allocation = self.allocation_box.currentData()
+        chroma = self.chroma_box.currentData()
         info = self.additional_info_box.text()
 
-        self.config = Config(rows, cols, frames, target_bpp, encoding, decoding, info)
+        self.config = Config(rows, cols, frames, target_bpp, encoding, decoding, info, allocation, chroma)
 
         sequence_exists = path.exists(self.sequence_path)
         decode_sequence_exists = path.exists(decoded_sequence_path(self.sequence_path, self.config.name))
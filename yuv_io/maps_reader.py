@@ -1,18 +1,21 @@
 import numpy as np
 
-from helpers.array_iterator import ArrayIterator
+from helpers.array_iterator import ArrayIterator, file_bytes
 from helpers.paths import video_shape
 
 
 class MapsReader:
-    def __init__(self, sequence_path, bgr_channel):
-        with open(sequence_path, 'rb') as file:
-            self.data = ArrayIterator(np.fromfile(file, dtype=np.uint8))
+    def __init__(self, sequence_path, bgr_channel, memory_map=True):
+        self.data = ArrayIterator(file_bytes(sequence_path, memory_map))
 
         self.shape = video_shape(sequence_path)
         self.frame_bytes = np.prod(self.shape)
+        self.frames_count = self.data.data.size // self.frame_bytes
         self.bgr_channel = bgr_channel
 
+    def seek(self, frame_idx):
+        self.data.position = frame_idx * self.frame_bytes
+
     def read_next(self):
         if not self.data.has_next():
             return None
@@ -21,3 +24,8 @@ class MapsReader:
         bgr_frame[:, :, self.bgr_channel] = self.data.get_many(self.shape)
 
         return bgr_frame
+
+    def read(self, frame_idx):
+        self.seek(frame_idx)
+
+        return self.read_next()
@@ -1,7 +1,11 @@
+from helpers.tracing import traced
+
+
 class MapsWriter:
     def __init__(self, file_path):
         self.file = open(file_path, 'wb')
 
+    @traced('write map frame')
     def write_next(self, frame):
         self.file.write(frame.flatten())
 
@@ -1,30 +1,63 @@
 import cv2 as cv
 import numpy as np
 
-from helpers.array_iterator import ArrayIterator
+from helpers.array_iterator import ArrayIterator, file_bytes
 from helpers.numpy_extensions import repeat_2d
 from helpers.paths import video_shape
+from helpers.tracing import traced
 
 
 class YuvReader:
-    def __init__(self, sequence_path):
-        with open(sequence_path, 'rb') as file:
-            self.data = ArrayIterator(np.fromfile(file, dtype=np.uint8))
+    def __init__(self, sequence_path, memory_map=True):
+        self.data = ArrayIterator(file_bytes(sequence_path, memory_map))
 
         self.y_shape = video_shape(sequence_path)
         self.uv_shape = (self.y_shape[0] // 2, self.y_shape[1] // 2)
+        self.frame_bytes = int(np.prod(self.y_shape) + 2 * np.prod(self.uv_shape))
+        self.frames_count = self.data.data.size // self.frame_bytes
 
-    def read_next(self):
+    def seek(self, frame_idx):
+        self.data.position = frame_idx * self.frame_bytes
+
+    @traced('read frame')
+    def read_next_planes(self, upsample_uv=False):
+        # planes in their own resolution are views into the file when it is memory mapped
         if not self.data.has_next():
             return None
 
         y = self.data.get_many(self.y_shape)
-        u = repeat_2d(self.data.get_many(self.uv_shape), (2, 2))
-        v = repeat_2d(self.data.get_many(self.uv_shape), (2, 2))
+        u = self.data.get_many(self.uv_shape)
+        v = self.data.get_many(self.uv_shape)
+
+        if upsample_uv:
+            u = repeat_2d(u, (2, 2))
+            v = repeat_2d(v, (2, 2))
+
+        return y, u, v
+
+    def read_next(self):
+        planes = self.read_next_planes(upsample_uv=True)
 
-        return np.dstack((y, u, v))
+        return np.dstack(planes) if planes is not None else None
 
     def read_next_as_bgr(self):
         frame = self.read_next()
 
         return cv.cvtColor(frame, cv.COLOR_YUV2BGR) if frame is not None else frame
+
+    def read_planes(self, frame_idx, upsample_uv=False):
+        self.seek(frame_idx)
+
+        return self.read_next_planes(upsample_uv)
+
+    @traced('read frames')
+    def read_planes_batch(self, start_idx, end_idx, upsample_uv=False):
+        # planes of frames from start_idx to end_idx, each stacked along the last axis
+        frames = [self.read_planes(idx, upsample_uv) for idx in range(start_idx, end_idx)]
+
+        return [np.stack([frame[plane_idx] for frame in frames], axis=2) for plane_idx in range(3)]
+
+    def read(self, frame_idx):
+        self.seek(frame_idx)
+
+        return self.read_next()
@@ -1,3 +1,6 @@
+from helpers.tracing import traced
+
+
 class YuvWriter:
     def __init__(self, file_path):
         self.file = open(file_path, 'wb')
@@ -7,6 +10,10 @@ class YuvWriter:
         u = yuv[1::2, 1::2, 1]
         v = yuv[1::2, 1::2, 2]
 
+        self.write_next_planes(y, u, v)
+
+    @traced('write frame')
+    def write_next_planes(self, y, u, v):
         self.file.write(y.flatten())
         self.file.write(u.flatten())
         self.file.write(v.flatten())